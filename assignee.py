@@ -1,27 +1,117 @@
+import re
 import requests
-from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 import json
 from props import props
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+session = None
+session_lock = threading.Lock()
+
+
+# reads the srelib credentials file once and returns an authenticated, pooled session
+def get_session():
+    global session
+    if session is None:
+        with session_lock:
+            if session is None:
+                credentials = props['credentials'] + "/srelib_credentials.json"
+                with open(credentials) as json_data:
+                    d = json.load(json_data)
+                username = base64.b64decode(bytes(d['credentials'][0]['u'], "utf-8")).decode('utf-8')
+                password = base64.b64decode(bytes(d['credentials'][0]['p'], "utf-8")).decode('utf-8')
+                s = requests.Session()
+                s.auth = (username, password)
+                s.headers.update({"Content-Type": "application/json",
+                                  "Accept": "application/json"})
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(props.get('assign_concurrency', 8)))
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                session = s
+    return session
 
 
 # assigns a ticket to someone
 def assign(issue_id, assignee):
-    credentials = props['credentials'] + "/srelib_credentials.json"
-    with open(credentials) as json_data:
-        d = json.load(json_data)
-    username = base64.b64decode(bytes(d['credentials'][0]['u'], "utf-8")).decode('utf-8')
-    password = base64.b64decode(bytes(d['credentials'][0]['p'], "utf-8")).decode('utf-8')
-    data = json.dumps({
+    d = json.dumps({
         "name": assignee,
-    })
-    d = data.encode('utf-8')
-    headers = {"Content-Type": "application/json",
-               "Accept": "application/json",
-               "Content-length": str(len(d))}
-    auth = HTTPBasicAuth(username, password)
-    response = requests.put(f"{props['jira_api_base']}/{issue_id}/assignee", headers=headers, auth=auth, data=d)
-    return response
+    }).encode('utf-8')
+    return get_session().put(f"{props['jira_api_base']}/{issue_id}/assignee", data=d, timeout=30)
+
+
+# Jira answers a successful assignment with an empty body
+def assigned(response):
+    return response.status_code in [200, 204]
+
+
+# assigns every ticket in ids to the same person, a limited number at a time
+# returns a list of [id, error] pairs where error is None on success
+def assign_many(ids, assignee):
+    def run(issue_id):
+        try:
+            response = assign(issue_id, assignee)
+        except requests.RequestException as e:
+            return [issue_id, str(e)]
+        if assigned(response):
+            return [issue_id, None]
+        try:
+            errors = response.json().get('errorMessages') or response.json().get('errors')
+        except json.decoder.JSONDecodeError:
+            errors = None
+        return [issue_id, f"{response.status_code} {errors}" if errors else str(response.status_code)]
+
+    with ThreadPoolExecutor(max_workers=int(props.get('assign_concurrency', 8))) as pool:
+        return list(pool.map(run, ids))
+
+
+# builds the reply for an assignment of one or more tickets
+def assign_summary(results, assignee):
+    done = [i[0] for i in results if i[1] is None]
+    failed = [i for i in results if i[1] is not None]
+    if len(results) == 1 and len(done) == 1:
+        return f"Ticket {done[0]} assigned to {assignee}."
+    msg = f"{len(done)} of {len(results)} tickets assigned to {assignee}."
+    if done:
+        msg += "<br>Assigned: " + ", ".join(done)
+    if failed:
+        msg += "<br>Failed: " + ", ".join(f"{i[0]} ({i[1]})" for i in failed)
+    return msg
+
+
+# expands '--id' values into a list of ticket IDs
+# accepts 'PI-1 PI-2', 'PI-1,PI-2' and ranges 'PI-1..PI-9' or 'PI-1..9'
+# returns False if any part isn't a valid ID or range, and None once there would be more than 'limit' IDs
+# (a range is checked against the limit before it's expanded)
+def expand_ids(values, check_valid_id, limit=None):
+    ids = []
+    for value in values:
+        for part in value.split(","):
+            if part == "":
+                continue
+            if ".." in part:
+                start, end = part.split("..", 1)
+                # the end is a full id of the same project or just its number
+                if not check_valid_id(start) or not (check_valid_id(end) or re.fullmatch(r"[0-9]+", end)):
+                    return False
+                project, first = start.split("-")
+                last = end.split("-")[-1]
+                if "-" in end and end.split("-")[0].upper() != project.upper():
+                    return False
+                if int(last) < int(first):
+                    return False
+                if limit is not None and len(ids) + int(last) - int(first) + 1 > limit:
+                    return None
+                ids += [f"{project.upper()}-{n}" for n in range(int(first), int(last) + 1)]
+            else:
+                if not check_valid_id(part):
+                    return False
+                if limit is not None and len(ids) + 1 > limit:
+                    return None
+                ids += [part.upper()]
+    return list(dict.fromkeys(ids))
 
 
 # checks to see if assign command is followed by the correct arguments
@@ -31,16 +121,16 @@ def check_assign_command(command):
     list1 = ['-id', '--id']
     list2 = ['-name', '--name']
     for num, info in enumerate(command):
-        if info == "--assign":
+        if info in ["--assign", "-a"]:
             index = num
             break
     if index is not None:
         # err = "'--assign' command must be followed by both '--id' and '--name' commands."
-        if len(command) - (index + 1) < 4:
+        rest = command[index+1:]
+        if len(rest) < 4:
             return False
-        if command[index+1] not in list1 and command[index+3] not in list1:
+        if not any(i in list1 for i in rest[:-1]):
             return False
-        if command[index+1] not in list2 and command[index+3] not in list2:
+        if not any(i in list2 for i in rest[:-1]):
             return False
     return True
-
@@ -3,9 +3,31 @@ from srelib.jira.jql_request import JQLRequest
 from request_object import RequestJQL
 import argparse
 import re
-from assignee import assign, check_assign_command
+from assignee import assign_many, assign_summary, check_assign_command, expand_ids
 from helper_functions import help_msg, correct_name, convert_time
-import json
+from props import props
+from ticket_history import HistoryStore, weekly_opened, resolve_times, assignee_load
+from paging import PageStore
+from user_directory import directory
+import datetime
+import threading
+import time
+
+
+# rows of long '--PI' listings past the first page, served by '--more <cursor>'
+# opened on first use, not at import: render workers import this module too
+pages = None
+pages_lock = threading.Lock()
+
+
+def get_pages():
+    global pages
+    if pages is None:
+        with pages_lock:
+            if pages is None:
+                pages = PageStore(props.get('pi_page_filepath', props['lease_filepath']),
+                                  page_size=int(props.get('pi_page_size', 10)), ttl=int(props.get('pi_page_ttl', 600)))
+    return pages
 
 
 # sets the commands for PI ticket parser
@@ -15,8 +37,12 @@ def set_commands_for_PI(spec_args):
         parser.add_argument(i[0], i[1], help=i[2], type=i[3])
     parser.add_argument("--assign", "-a", help="Assign ticket to an employee.", action="store_true")
     parser.add_argument("--name", "-name", help="Username of assignee.", type=str)
-    parser.add_argument("--id", "-id", help="PI Ticket ID", type=str)
+    parser.add_argument("--id", "-id", help="PI Ticket ID(s), e.g. 'PI-1 PI-2', 'PI-1,PI-2' or 'PI-1..PI-9'", type=str,
+                        nargs="+")
     parser.add_argument("--all", "-all", help="See open PI tickets. ", action="store_true")
+    parser.add_argument("--stats", "-stats", nargs="?", const="weekly", choices=["weekly", "resolve", "load"],
+                        help="Ticket history stats: tickets opened per week (default), hours to resolve by priority, "
+                             "or open tickets per assignee. '-ct' limits it to tickets created since a date.")
     return parser
 
 
@@ -57,15 +83,7 @@ def check_name_before_assign(args, obj_dict):
 
 # checks format of ticket ID
 def check_valid_id(id):
-    if "-" not in id:
-        return False
-    parts = id.split("-")
-    parts[0] = parts[0].upper()
-    if not parts[0].isalpha():
-        return False
-    if not parts[1].isnumeric():
-        return False
-    return True
+    return bool(re.fullmatch(r"[A-Za-z]+-[0-9]+", id))
 
 
 # creates the request_object, checks for all errors
@@ -86,11 +104,22 @@ def create(args, parser):
         return 6, 0
     if not check_name_before_assign(args, obj_dict):  # can't specify --name before assign
         return 7, 0
+    if obj_dict['stats']:  # answered from the local ticket history, no jira query
+        since = 0
+        if obj_dict["created"]:
+            if not re.match("[12]\d{3}[/](0[1-9]|1[0-2])[/](0[1-9]|[12]\d|3[01])", obj_dict['created']):
+                return 3, 0
+            since = datetime.datetime.strptime(obj_dict['created'][:10], "%Y/%m/%d").timestamp()
+        return 11, pi_stats(obj_dict['stats'], since)
     req_obj = RequestJQL()
     # when name is before --assign, and is used for query purposes:
     if type(get_name_index(args)) is not bool:  # if --name is specified
-        name = correct_name(obj_dict['name'])  # reformats name for query
-        req_obj.set_assignee(name)  # add it to object
+        # resolves the name to a Jira username from the local user index, before any Jira call
+        # assigning tickets needs an exact match, a prefix could hand them to the wrong person
+        found = directory.resolve(correct_name(obj_dict['name']), exact=obj_dict['assign'] is True)
+        if found[0] != "ok":  # ambiguous, inexact or unknown name, suggestions go back to the user
+            return 13, [obj_dict['name']] + found
+        req_obj.set_assignee(found[1])  # add it to object
     # set_all() sets value of 'all' to either true or false depending on command
     req_obj.set_all(obj_dict['all'])
     # if assigning a ticket:
@@ -98,19 +127,19 @@ def create(args, parser):
         # ensures that --assign is followed by --name and --id
         if not check_assign_command(args):  # returns boolean
             return 9, 0
-        id = obj_dict['id']
-        if not check_valid_id(id):  # check to see if ticket id is valid format
+        ids = expand_ids(obj_dict['id'] or [], check_valid_id, int(props.get('assign_max_tickets', 100)))
+        if ids is None:  # more tickets than one command may assign
+            return 12, 0
+        if not ids:  # check to see if every ticket id is valid format
             return 8, 0
-        name = obj_dict['name']  # used for assigning to a name
-        if id is not None and name is not None:
-            response = assign(id, name)
-            try:
-                print(response.json())
+        name = req_obj.get_assignee()  # username resolved above, used for assigning
+        if name is not None:
+            results = assign_many(ids, name)
+            if len(ids) == 1 and results[0][1] is not None:
+                print(results[0][1])
                 return 4, 0
-            except json.decoder.JSONDecodeError:
-                print("Assignee changed.")
-            comb_info = id + "," + name  # send both through, for confirmation message
-            return 10, comb_info
+            print("Assignee changed.")
+            return 10, assign_summary(results, directory.display_name(name))  # confirmation message
     # for specifying max query results
     if obj_dict["n"]:
         try:
@@ -152,23 +181,77 @@ def brian_function(request):
             return f"No new unassigned Production Issue Tickets for \"{assignee}\"."
         return f"No open Production Issue Tickets for \"{assignee}\"."
     # begin building table
-    return_string = "<table style='border-collapse:collapse;'>"
     name_header = ""
     if flag == 1:
         name_header = "<th>Name: </th>"
-    return_string += f"<tr><th>Issue:</th><th>Title:</th><th>Created (UTC):</th><th>Priority:</th>{name_header}</tr> "
+    header = f"<tr><th>Issue:</th><th>Title:</th><th>Created (UTC):</th><th>Priority:</th>{name_header}</tr> "
+    rows = []
     for i in search_results.get_issues():
-        return_string += "<tr>"
+        row = "<tr>"
         issue_id = str(i).split("=")[1][1:]
         title = i.get_summary()
         created = convert_time(i.get_create_date())
         priority = i.get_priority().get_name()
         for j in [issue_id, title, created, priority]:
-            return_string += f"<td style='padding-right: 7px; padding-left: 7px; border: solid 1px black;'>{j}</td>"
+            row += f"<td style='padding-right: 7px; padding-left: 7px; border: solid 1px black;'>{j}</td>"
         if flag == 1:
             table_name = i.get_assignee().get_display_name()
-            return_string += f"<td style='padding-right: 7px; padding-left: 7px; border: solid 1px black;'>{table_name}</td>"
-        return_string += "</tr>"
-    return_string += "</table>"
+            row += f"<td style='padding-right: 7px; padding-left: 7px; border: solid 1px black;'>{table_name}</td>"
+        row += "</tr>"
+        rows += [row]
     print("No errors encountered.")
+    # only the first page is sent, the rest is kept for '--more'
+    cursor = get_pages().add(header, rows)
+    return page_table(header, rows[:get_pages().page_size], 1, len(rows), cursor)
+
+
+def page_table(header, rows, first, total, cursor):
+    return_string = "<table style='border-collapse:collapse;'>" + header + "".join(rows) + "</table>"
+    if cursor:
+        return_string += (f"Showing {first}-{first + len(rows) - 1} of {total}. "
+                          f"Type '--more {cursor}' for the next {get_pages().page_size}.")
+    elif first > 1:
+        return_string += f"Showing {first}-{first + len(rows) - 1} of {total}."
     return return_string
+
+
+# serves the next page of a '--PI' listing from memory, for '--more <cursor>'
+def more_function(args):
+    if len(args) != 1:
+        return "Usage: --more &lt;cursor&gt;, with the cursor from the end of a '--PI' listing."
+    page = get_pages().get(args[0])
+    if page is None:
+        return f"Cursor '{args[0]}' is unknown or has expired. Please run the '--PI' search again."
+    header, rows, first, total, cursor = page
+    return page_table(header, rows, first, total, cursor)
+
+
+def stats_table(header, rows):
+    cell = "<td style='padding-right: 7px; padding-left: 7px; border: solid 1px black;'>{}</td>"
+    return_string = "<table style='border-collapse:collapse;'><tr>"
+    return_string += "".join(f"<th>{i}</th>" for i in header) + "</tr>"
+    for row in rows:
+        return_string += "<tr>" + "".join(cell.format(i) for i in row) + "</tr>"
+    return return_string + "</table>"
+
+
+# aggregates over the ticket history pi_channel records
+def pi_stats(kind, since):
+    t = time.time()
+    columns, dictionaries = HistoryStore(props['pi_history_path']).load()
+    if len(columns['ts']) == 0:
+        return "No PI ticket history recorded yet."
+    if kind == "weekly":
+        rows = weekly_opened(columns, dictionaries, since)
+        string = stats_table(["Week of:", "Tickets opened:"], rows)
+    elif kind == "resolve":
+        rows = resolve_times(columns, dictionaries, since)
+        rows = [[i[0], i[1], f"{i[2]:.1f}", f"{i[3]:.1f}"] for i in rows]
+        string = stats_table(["Priority:", "Resolved:", "Mean hours:", "Median hours:"], rows)
+    else:
+        rows = assignee_load(columns, dictionaries)
+        string = stats_table(["Assignee:", "Open tickets:"], rows)
+    print(f"Stats '{kind}' over {len(columns['ts'])} events in {time.time()-t:.4f} seconds.")
+    if len(rows) == 0:
+        return "No matching PI ticket history."
+    return string
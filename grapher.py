@@ -3,12 +3,118 @@ import matplotlib
 from matplotlib.figure import Figure
 import io
 import numpy as np
-import os
-from PIL import Image
-import PIL
 import datetime
 
 
+FIG_SIZE = (6, 4.8)
+DPI = 100
+
+
+# converts a tsdb 'dps' dictionary into compact timestamp and value arrays
+# points served by the series cache are already a (timestamps, values) pair
+def to_arrays(points):
+	if type(points) is tuple:
+		return points
+	xs = np.fromiter(points.keys(), dtype=np.float64, count=len(points))
+	ys = np.fromiter(points.values(), dtype=np.float64, count=len(points))
+	return xs, ys
+
+
+# plots (timestamps, values) series on an axis and labels the time axis
+def draw_series(axis, series, labels, **style):
+	lines = []
+	for index, (xs, ys) in enumerate(series):
+		if (len(labels)>0):
+			lines += axis.plot(xs, ys, label=labels[index], **style)
+		else:
+			lines += axis.plot(xs, ys, **style)
+	ticks = [xs for xs, ys in series if len(xs) > 0]
+	if ticks:
+		xs = ticks[-1]
+		x_ind = np.linspace(0, len(xs)-1, 5)
+		xticks = [xs[int(j)] for j in x_ind]
+		ticklabels = [str(datetime.datetime.fromtimestamp(int(unix))) for unix in xticks]
+		axis.set_xticks(ticks=xticks)
+		axis.set_xticklabels(ticklabels, rotation=30)
+	return lines
+
+
+# shades the min/max range of the series folded into 'other'
+def draw_band(axis, band):
+	xs, low, high, label = band
+	return [axis.fill_between(xs, low, high, color="grey", alpha=0.3, linewidth=0, label=label)]
+
+
+def legend(axis, handles=None):
+	axis.legend(handles=handles, loc="upper right", fontsize=8, borderpad=0, labelspacing=0, title_fontsize='small', fancybox=True)
+
+
+# clears a reused figure, including any spacing changed by an earlier render
+def reset(fig, size):
+	fig.clf()
+	fig.set_size_inches(size)
+	params = matplotlib.rcParams
+	fig.subplots_adjust(left=params['figure.subplot.left'], right=params['figure.subplot.right'],
+		bottom=params['figure.subplot.bottom'], top=params['figure.subplot.top'],
+		wspace=params['figure.subplot.wspace'], hspace=params['figure.subplot.hspace'])
+
+
+def to_png(fig):
+	output = io.BytesIO()
+	fig.savefig(output, format="png")
+	return output.getvalue()
+
+
+# draws the series onto a (possibly reused) figure and returns the png bytes
+# series is a list of (timestamps, values) arrays
+def render_png(fig, title, xlabel, ylabel, series, labels, band=None):
+	reset(fig, FIG_SIZE)
+	axis = fig.add_subplot(1,1,1)
+	draw_series(axis, series, labels)
+	if band is not None:
+		draw_band(axis, band)
+	axis.set_title(title)
+	axis.set_xlabel(xlabel)
+	axis.set_ylabel(ylabel)
+	if (len(labels)>0):
+		legend(axis)
+	return to_png(fig)
+
+
+# draws several metrics in one figure and returns the png bytes
+# panels are dicts of title, ylabel, series, labels and an optional band
+# 'stacked' gives each metric its own subplot on a shared time axis, 'dual' puts two metrics on left and right axes
+def render_panels(fig, title, xlabel, panels, layout="stacked"):
+	if layout == "dual" and len(panels) == 2:
+		reset(fig, FIG_SIZE)
+		left = fig.add_subplot(1,1,1)
+		right = left.twinx()
+		handles = []
+		for axis, panel, color in [[left, panels[0], "tab:blue"], [right, panels[1], "tab:red"]]:
+			handles += draw_series(axis, panel['series'], [panel['title'] + " " + i for i in panel['labels']], color=color)
+			if panel.get('band') is not None:
+				handles += draw_band(axis, panel['band'])
+			axis.set_ylabel(panel['ylabel'], color=color)
+		left.set_title(title)
+		left.set_xlabel(xlabel)
+		legend(left, handles)
+		return to_png(fig)
+	reset(fig, (FIG_SIZE[0], max(FIG_SIZE[1], 2.4 * len(panels))))
+	axes = fig.subplots(len(panels), 1, sharex=True, squeeze=False)[:, 0]
+	for axis, panel in zip(axes, panels):
+		draw_series(axis, panel['series'], panel['labels'])
+		if panel.get('band') is not None:
+			draw_band(axis, panel['band'])
+		axis.set_title(panel['title'], fontsize=10)
+		axis.set_ylabel(panel['ylabel'], fontsize=8)
+		if (len(panel['labels'])>0):
+			legend(axis)
+	axes[-1].set_xlabel(xlabel)
+	fig.suptitle(title)
+	fig.tight_layout()
+	return to_png(fig)
+
+
 class Graph:
 	def __init__(self, data, labels, title, xlabel, ylabel):
 		self.title = title
@@ -20,42 +126,10 @@ class Graph:
 
 	def get_base64(self):
 		if (self.data):
-			fig = Figure(figsize=(6,4.8), dpi=100)
-			axis = fig.add_subplot(1,1,1)
-			for i in enumerate(self.data):
-				index = i[0]
-				points = i[1]
-				xs = list(points.keys())
-				ys = list(points.values())
-				if (len(self.labels)>0):
-					axis.plot(xs, ys, label=self.labels[index])
-				else:
-					axis.plot(xs, ys)
-				total_dps = len(xs)
-				x_ind = np.linspace(0, total_dps-1, 5)
-				xticks = []
-				ticklabels=[]
-				for j in x_ind:
-					unix = xs[int(j)]
-					xticks += [unix]
-					ticklabels += [str(datetime.datetime.fromtimestamp(int(unix)))]
-				axis.set_title(self.title)
-				axis.set_xlabel(self.xlabel)
-				axis.set_ylabel(self.ylabel)
-				axis.set_xticks(ticks=xticks)
-				axis.set_xticklabels(ticklabels, rotation=30)
-				if (len(self.labels)>0):
-					axis.legend(loc="upper right", fontsize=8, borderpad=0, labelspacing=0, title_fontsize='small', fancybox=True)
-			output = io.BytesIO()
-			fig.savefig('figure1.png')
-			image = PIL.Image.open('figure1.png')
-			image.save(output, format="PNG")
-			output.seek(0)
-			bytesobject = output.read()
-			base = base64.b64encode(bytesobject)
-			dec = base.decode('utf-8')
-			os.remove('figure1.png')
-			return dec
+			fig = Figure(figsize=FIG_SIZE, dpi=DPI)
+			series = [to_arrays(points) for points in self.data]
+			png = render_png(fig, self.title, self.xlabel, self.ylabel, series, self.labels)
+			return base64.b64encode(png).decode('utf-8')
 		return False
 
 	def check_data(self):
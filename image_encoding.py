@@ -0,0 +1,72 @@
+import base64
+import io
+import time
+from PIL import Image
+
+
+class EncodedImage:
+    def __init__(self, data, content_type, method, encode_time, width, height):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.content_type = content_type
+        self.method = method
+        self.encode_time = encode_time
+        self.size = len(data)
+
+    def get_base64(self):
+        return base64.b64encode(self.data).decode('utf-8')
+
+
+def palette_png(image, colors):
+    quantized = image.quantize(colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    output = io.BytesIO()
+    quantized.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def jpeg(image, quality):
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def webp(image, quality):
+    output = io.BytesIO()
+    image.save(output, format="WEBP", quality=quality, method=4)
+    return output.getvalue()
+
+
+# candidate encodings, best looking first
+# graphs are flat colours and thin lines, so a palette png is usually both the smallest and lossless to the eye
+def candidates(formats):
+    steps = []
+    if "png" in formats:
+        steps += [("png-256", "image/png", lambda im: palette_png(im, 256)),
+                  ("png-64", "image/png", lambda im: palette_png(im, 64))]
+    if "webp" in formats:
+        steps += [("webp-90", "image/webp", lambda im: webp(im, 90)),
+                  ("webp-75", "image/webp", lambda im: webp(im, 75))]
+    if "jpeg" in formats:
+        steps += [("jpeg-90", "image/jpeg", lambda im: jpeg(im, 90)),
+                  ("jpeg-75", "image/jpeg", lambda im: jpeg(im, 75)),
+                  ("jpeg-60", "image/jpeg", lambda im: jpeg(im, 60))]
+    return steps
+
+
+# re-encodes a rendered png, returning the first candidate that fits in the byte budget
+# if nothing fits, the smallest candidate (or the original png) is returned
+def encode_image(png, budget=None, formats=("png", "jpeg")):
+    t = time.time()
+    image = Image.open(io.BytesIO(png)).convert("RGB")
+    best = ("png", "image/png", png)
+    for method, content_type, encode in candidates(formats):
+        data = encode(image)
+        if len(data) < len(best[2]):
+            best = (method, content_type, data)
+        if budget and len(data) <= budget:
+            best = (method, content_type, data)
+            break
+        if not budget:
+            break
+    return EncodedImage(best[2], best[1], best[0], time.time() - t, image.width, image.height)
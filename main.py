@@ -1,28 +1,182 @@
-from teams_message import check_new_messages, post_message, post_image
-from message_parser import parse_message
+from teams_message import check_new_messages, post_message, post_encoded_image, render_reply, mark_processed, \
+    get_leases
+from message_parser import parse_message, strip_space, presets
+from make_graph import start_render_pool
+from render_pool import RenderError
+import os
 import time
+import traceback
 from props import props
+import profiling
+import watches
+import threading
+from scheduler import Scheduler, parse_weights
+from single_flight import SingleFlight
 
 
-while True:
-    new_message = check_new_messages()
-    if new_message:
-        for i in new_message:
-            argument = i[0]
-            id = i[2]
-            base_channel = f"{props['base_url']}/teams/{props['teams_id']}/channels/{props['channel_id']}/messages"
-            teamschannel = base_channel + "/" + str(id) + "/replies"
-            # code specifies case type, url is for images, message includes responses
-            code, url, message = parse_message(argument)
-            if code == 1:
-                post_message(message, teamschannel)
-                print("Response sent.")
-                print("-"*40)
-            elif code == 2:
-                t2 = time.time()
-                print(f"Posting image...")
-                post_image(teamschannel, url)
-                print(f"Image posted in {time.time()-t2} seconds.")
-                print("-"*40)
-    time.sleep(int(props['query_time']))
+# messages claimed by this instance that are queued or running
+in_flight = set()
+in_flight_lock = threading.Lock()
 
+# built by setup() rather than at import, since the render pool's spawned workers import this module again
+# metric threshold watches set with '--watch', checked in the background
+watch_store = None
+# identical commands asked at about the same time (e.g. everyone posting 'hbase' during an incident) are answered once
+replies = None
+# lanes of worker threads that answer the claimed messages
+scheduler = None
+setup_lock = threading.Lock()
+
+
+# answers one claimed message in its thread, then records it as processed
+def handle_message(i):
+    id = i[2]
+    base_channel = f"{props['base_url']}/teams/{props['teams_id']}/channels/{props['channel_id']}/messages"
+    teamschannel = base_channel + "/" + str(id) + "/replies"
+    try:
+        # the message may have waited in its lane past the lease, in which case another instance has it now
+        if not get_leases().renew(id):
+            return
+        words = strip_space(i[0])
+        admins = [a.strip() for a in props.get('admin_user_ids', "").split(",") if a.strip()]
+        if words and words[0] == "--debug":
+            post_message(profiling.command(words, i[3], teamschannel, admins, props.get('profile_dir', ".")),
+                         teamschannel)
+        elif words and words[0] == "--watch":
+            post_message(watches.command(words, i[1], i[3], teamschannel, admins, watch_store), teamschannel)
+        elif profiling.session is not None:
+            profiling.profile_call(answer, i[0], teamschannel)
+        else:
+            answer(i[0], teamschannel)
+        mark_processed(i)
+    except Exception:
+        traceback.print_exc()
+        give_up(i, teamschannel)
+
+
+# after a failed attempt the lease is given back so this or another instance can retry the message,
+# the last allowed attempt instead answers with an error and records the message as processed
+def give_up(i, teamschannel):
+    try:
+        if get_leases().last_attempt(i[2]):
+            post_message("Sorry, this command failed and won't be retried. Please try again later.", teamschannel)
+            mark_processed(i)
+            return
+    except Exception:
+        traceback.print_exc()
+    get_leases().release(i[2])
+
+
+# parses a command and builds its reply: ["text", message] or ["image", EncodedImage]
+def build_reply(argument):
+    # code specifies case type, url is for images, message includes responses
+    code, url, message = parse_message(argument)
+    if code == 1:
+        return ["text", message]
+    t2 = time.time()
+    try:
+        image = render_reply(code, url)
+    except RenderError as e:
+        print(f"Render failed: {e}")
+        return ["text", f"Graph could not be rendered: {e}"]
+    print(f"Image rendered in {time.time()-t2} seconds.")
+    return ["image", image]
+
+
+# builds the reply, shared with any identical command answered at about the same time, and posts it in this thread
+def answer(argument, teamschannel):
+    (kind, reply), shared = replies.do(" ".join(strip_space(argument)), build_reply, argument)
+    if shared:
+        print("Reply shared with an identical command.")
+    if kind == "text":
+        post_message(reply, teamschannel)
+    else:
+        post_encoded_image(teamschannel, reply)
+    print("Response sent.")
+    print("-"*40)
+
+
+# posts the report of a finished profile capture
+def check_profile():
+    report = profiling.finish(profile_dir=props.get('profile_dir', "."))
+    if report:
+        post_message(report[1], report[0])
+
+
+# graph lane threads default to one per render worker, more would only queue in the render pool
+def graph_lane_size():
+    if props.get('lane_graph'):
+        return int(props['lane_graph'])
+    return int(props['render_workers']) if props.get('render_workers') else os.cpu_count()
+
+
+# picks the scheduler lane for a message by its first word
+# graphs render for seconds, jira commands wait on jira, everything else answers right away
+def command_lane(words):
+    if len(words) == 0:
+        return "quick"
+    if words[0] in presets or words[0] in ["-m", "--metric", "--compare"]:
+        return "graph"
+    if words[0] == "--PI":
+        if any(i in words for i in ["-h", "--help", "--stats"]):
+            return "quick"
+        return "jira"
+    return "quick"
+
+
+def setup():
+    global watch_store, replies, scheduler
+    with setup_lock:
+        if scheduler is not None:
+            return
+        watch_store = watches.WatchStore(props['watch_filepath'])
+        replies = SingleFlight(keep=float(props.get('reply_share_seconds', 10)))
+        scheduler = Scheduler({"quick": int(props.get('lane_quick', 4)),
+                               "jira": int(props.get('lane_jira', 4)),
+                               "graph": graph_lane_size()},
+                              rate=float(props.get('user_rate', 0.2)),
+                              burst=float(props.get('user_burst', 5)),
+                              weights=parse_weights(props.get('user_weights', "")))
+
+
+def run_message(i):
+    try:
+        handle_message(i)
+    finally:
+        with in_flight_lock:
+            in_flight.discard(i[2])
+
+
+# claims new messages and queues them in their lanes, they are answered by the lane workers
+def poll():
+    setup()
+    with in_flight_lock:
+        skip = set(in_flight)
+    new_message = check_new_messages(skip)
+    for i in new_message:
+        with in_flight_lock:
+            in_flight.add(i[2])
+        scheduler.submit(command_lane(strip_space(i[0])), i[1], lambda i=i: run_message(i))
+
+
+if __name__ == "__main__":
+    # warm the render workers before the first graph command arrives
+    start_render_pool()
+    setup()
+    watches.WatchScheduler(watch_store, interval=int(props.get('watch_interval', 60)),
+                           window=props.get('watch_window', "10m-ago"),
+                           hysteresis=float(props.get('watch_hysteresis', 0.05))).start()
+    pruned = 0
+    while True:
+        # a failed poll (graph, lease store or processed file errors) is logged and retried on the next one
+        try:
+            poll()
+            if profiling.session is not None:
+                check_profile()
+            # old message and watch round leases are only kept long enough to stop duplicate replies
+            if time.time() - pruned > 3600:
+                pruned = time.time()
+                print(f"Pruned {get_leases().prune(int(props.get('lease_keep_seconds', 86400)))} old leases.")
+        except Exception:
+            traceback.print_exc()
+        time.sleep(int(props['query_time']))
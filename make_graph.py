@@ -1,21 +1,104 @@
 import requests
-from grapher import Graph
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from grapher import to_arrays
+from props import props
+from render_pool import get_pool
+from series_selection import select_series, top_series
+from series_cache import SeriesCache
+import profiling
 
 
-def graphdata(url):
-    r = requests.get(url)
-    data = r.json()
+# one pooled session for all tsdb queries
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_maxsize=int(props.get('tsdb_connections', 8))))
+session.mount("https://", HTTPAdapter(pool_maxsize=int(props.get('tsdb_connections', 8))))
+
+series_cache = SeriesCache(int(props.get('series_cache_bytes', 64 * 1024 * 1024)),
+                           step=int(props.get('tsdb_resolution', 60)))
+
+
+# starts the render workers, sized and timed from teamsbot.properties
+def start_render_pool():
+    size = int(props['render_workers']) if props.get('render_workers') else None
+    return get_pool(size, int(props.get('render_timeout', 30)))
+
+
+def fetch_tsdb(url):
+    r = session.get(url)
+    return r.json()
+
+
+# tsdb query through the series cache, repeated graphs of a moving window only fetch the new tail
+def fetch_data(url):
+    return series_cache.get(url, fetch_tsdb)
+
+
+# runs several tsdb queries at the same time, results come back in the same order as the urls
+def fetch_all(urls):
+    with ThreadPoolExecutor(max_workers=min(len(urls), int(props.get('tsdb_connections', 8)))) as pool:
+        return list(pool.map(fetch_data, urls))
+
+
+# converts a tsdb response into plot series, keeping render cost bounded for high-cardinality tags
+# every series is scored, the series_hard_cap highest are aligned, the top k of those by rank are drawn and
+# the rest become one 'other' band
+def to_series(data, top=None, rank=None):
+    cap = int(props.get('series_hard_cap', 500))
+    rank = rank if rank else "max"
+    note = ""
+    series = [to_arrays(d['dps']) for d in data]
+    labels = [print_dict_info(d['tags']) for d in data]
+    if len(series) > cap:
+        note = f" (top {cap} of {len(series)} series by {rank})"
+        keep = top_series(series, cap, rank)
+        series = [series[i] for i in keep]
+        labels = [labels[i] for i in keep]
+    top = top if top else int(props.get('top_k_series', 10))
+    series, labels, band = select_series(series, labels, top, rank)
+    return series, labels, band, note
+
+
+# turns one tsdb response into a panel for render_panels
+def to_panel(data, top=None, rank=None):
+    series, labels, band, note = to_series(data, top, rank)
+    return {"title": data[0]['metric'] + note,
+            "ylabel": data[0]['metric'],
+            "series": series,
+            "labels": labels,
+            "band": band}
+
+
+# renders several already fetched tsdb responses into one figure
+def graph_panels(datas, layout, top=None, rank=None):
+    panels = [to_panel(data, top, rank) for data in datas]
+    title = " vs ".join(i['ylabel'] for i in panels)
+    graph = {"title": title, "xlabel": "Time", "panels": panels, "layout": layout}
+    return render_image(graph)
+
+
+def graphdata(url, top=None, rank=None):
+    data = fetch_data(url)
     if len(data) == 0:
         return 1
-    li = []
-    la = []
-    for n, d in enumerate(data):
-        li += [d['dps']]
-        la += [print_dict_info(data[n]['tags'])]
-        title = data[n]['metric'] + " over Time"
-        ylabel = data[n]['metric']
-    g1 = Graph(data=li, labels=la, title=title, xlabel="Time", ylabel=ylabel)
-    return g1.get_base64()
+    li, la, band, note = to_series(data, top, rank)
+    title = data[0]['metric'] + " over Time" + note
+    ylabel = data[0]['metric']
+    graph = {"title": title, "xlabel": "Time", "ylabel": ylabel, "series": li, "labels": la, "band": band}
+    return render_image(graph)
+
+
+# renders a graph in the pool and encodes it within the configured byte budget
+def render_image(graph):
+    encoding = {"budget": int(props.get('image_byte_budget', 0)),
+                "formats": props.get('image_formats', "png").split(",")}
+    if profiling.session is not None:
+        image, stats = start_render_pool().render(graph, encoding, profile=True)
+        profiling.add_worker_stats(stats)
+    else:
+        image = start_render_pool().render(graph, encoding)
+    print(f"Image encoded as {image.method}: {image.size} bytes in {image.encode_time:.3f} seconds.")
+    return image
 
 
 def print_dict_info(dict1):
@@ -30,4 +113,3 @@ def print_dict_info(dict1):
             str += ", "
         string += str
     return string + "}"
-
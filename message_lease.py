@@ -0,0 +1,87 @@
+import os
+import socket
+import sqlite3
+import time
+
+
+class LeaseStore:
+    def __init__(self, path, ttl=300, max_attempts=3, owner=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.owner = owner if owner else f"{socket.gethostname()}-{os.getpid()}"
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS leases ("
+                         "message_id TEXT PRIMARY KEY, "
+                         "owner TEXT NOT NULL, "
+                         "expires_at REAL NOT NULL, "
+                         "attempts INTEGER NOT NULL DEFAULT 1, "
+                         "done INTEGER NOT NULL DEFAULT 0)")
+
+    # one short-lived connection per call, so the store can be used from any thread or process
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    # atomically takes ownership of a message
+    # succeeds if nobody holds it, or the previous owner's lease expired (crashed worker)
+    def claim(self, message_id):
+        now = time.time()
+        conn = self.connect()
+        try:
+            cur = conn.execute("INSERT INTO leases (message_id, owner, expires_at) VALUES (?, ?, ?) "
+                               "ON CONFLICT(message_id) DO UPDATE SET "
+                               "owner = excluded.owner, expires_at = excluded.expires_at, "
+                               "attempts = leases.attempts + 1 "
+                               "WHERE leases.done = 0 AND leases.expires_at < ? AND leases.attempts < ?",
+                               (message_id, self.owner, now + self.ttl, now, self.max_attempts))
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    # extends a lease this instance still holds, e.g. when a queued message finally starts running
+    # returns False if the lease expired and another instance took the message over
+    def renew(self, message_id):
+        conn = self.connect()
+        try:
+            cur = conn.execute("UPDATE leases SET expires_at = ? WHERE message_id = ? AND owner = ? AND done = 0",
+                               (time.time() + self.ttl, message_id, self.owner))
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    # marks a message as handled so no other instance picks it up again
+    def complete(self, message_id):
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE leases SET done = 1 WHERE message_id = ?", (message_id,))
+        finally:
+            conn.close()
+
+    # true when this instance holds the message's last allowed attempt, so it won't be claimed again
+    def last_attempt(self, message_id):
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT attempts FROM leases WHERE message_id = ? AND owner = ?",
+                               (message_id, self.owner)).fetchone()
+            return row is not None and row[0] >= self.max_attempts
+        finally:
+            conn.close()
+
+    # deletes finished and expired leases older than 'horizon' seconds, returns how many
+    def prune(self, horizon):
+        conn = self.connect()
+        try:
+            return conn.execute("DELETE FROM leases WHERE expires_at < ?", (time.time() - horizon,)).rowcount
+        finally:
+            conn.close()
+
+    # hands a message back before its lease runs out, e.g. after a failed reply
+    def release(self, message_id):
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE leases SET expires_at = 0 WHERE message_id = ? AND owner = ? AND done = 0",
+                         (message_id, self.owner))
+        finally:
+            conn.close()
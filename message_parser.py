@@ -1,18 +1,22 @@
-from srelib.metrics.visualization import MetricGraph
+from query_planner import planned_url, FUNCTIONS
+from series_selection import RANKINGS
 import argparse
 import datetime
 import re
 from teams_message import check_data
+from make_graph import fetch_all
 import requests
-from brian_PI import brian_function, create, set_commands_for_PI
+from brian_PI import brian_function, create, set_commands_for_PI, more_function
 from helper_functions import help_msg
+from props import props
 
 presets = {
-    "bidding": [{"response_type": "BID", "full_name": "rtb.requests.bid"}, "Type --rtb.requests to see Bidding metric.",
-                "store_true"],
-    "hbase": [{"summary_type": "999_PCT", "full_name": "tsunami.hbase.read.duration"},
+    "bidding": [{"response_type": "BID", "full_name": "rtb.requests.bid", "downsample": "avg"},
+                "Type --rtb.requests to see Bidding metric.", "store_true"],
+    "hbase": [{"summary_type": "999_PCT", "full_name": "tsunami.hbase.read.duration", "downsample": "max"},
               "Type --tsunami.hbase.read.duration to see hbase metric.", "store_true"],
-    "dma.requests": [{"full_name": "dma.requests"}, "Type --dma.requests to see this metric. ", "store_true"]
+    "dma.requests": [{"full_name": "dma.requests", "downsample": "avg"}, "Type --dma.requests to see this metric. ",
+                     "store_true"]
 }
 
 spec_args = [["-n", "--n", "Specify maximum number of tickets displayed.", str],
@@ -21,7 +25,12 @@ spec_args = [["-n", "--n", "Specify maximum number of tickets displayed.", str],
 other_commands = [["-m", "--metric", "Specify a metric"],
                   ["-t", "--tags", "Specify tags in form 'key=value'"],
                   ["-f", "--fromtime", "Specify beginning of time interval. Default is 1d-ago. "],
-                  ["-e", "--endtime", "Specify end of time interval. Default is to current. "]]
+                  ["-e", "--endtime", "Specify end of time interval. Default is to current. "],
+                  ["-ds", "--downsample", "Downsample function for long intervals: avg, max, min, sum or none. "
+                                          "Default is avg. "],
+                  ["-top", "--top", "Number of series drawn when tags match many series, the rest are shaded as "
+                                    "'other'. Default is 10. "],
+                  ["-rank", "--rank", "How series are ranked for --top: max, mean or p99. Default is max. "]]
 
 
 # sets the commands for grapher mode
@@ -68,7 +77,7 @@ def validate_tags(tag, tags_dict):
 
 
 def check_valid_metric(metric_name):
-    url = "http://tsdb.dc.dotomi.net/api/query?start=15m-ago&m=sum:" + metric_name
+    url = props.get('tsdb_base', "http://tsdb.dc.dotomi.net") + "/api/query?start=15m-ago&m=sum:" + metric_name
     r = requests.get(url)
     data = r.json()
     return type(data) is list
@@ -92,7 +101,8 @@ error_dict = {
     6: "Cannot use '--name', '--id', '--assign', arguments after '--all' argument.",
     7: "Cannot specify '--name' before '--assign' command. ",
     8: "Invalid ticket ID. ID must be in format: 'PROJECT-0000'.",
-    9: "'--assign' command must be followed by both '--id' and '--name' commands."
+    9: "'--assign' command must be followed by both '--id' and '--name' commands.",
+    12: "Too many tickets in one '--assign' command."
 }
 
 
@@ -107,17 +117,28 @@ def config_brian_errors(code, info):
         return error_dict[code]
     elif code == 10:
         print("No errors encountered.")
-        if "," in info:
-            info = info.split(",")
-            name = info[1]
-            id = info[0]
-            msg = f"Ticket {id} assigned to {name}."
+        msg = info
     elif code == 11:
         print("No errors encountered.")
         msg = info
+    elif code == 13:
+        print("Error encountered.")
+        msg = name_error(*info)
     return msg
 
 
+# error message for a '--name' the user directory couldn't resolve to one Jira user
+def name_error(name, kind, suggestions):
+    if kind == "ambiguous":
+        return f"'{name}' matches several Jira users: {', '.join(suggestions)}. Please use one of the usernames."
+    if kind == "inexact":
+        return (f"'{name}' isn't the full name of a Jira user, assigning needs an exact name or username. "
+                f"Did you mean: {', '.join(suggestions)}?")
+    if suggestions:
+        return f"No Jira user named '{name}'. Did you mean: {', '.join(suggestions)}?"
+    return f"No Jira user named '{name}'."
+
+
 # Removes all empty spaces from commands.
 def strip_space(arg):
     stripped_word = ""
@@ -130,10 +151,105 @@ def strip_space(arg):
     return msg
 
 
+# checks the series selection options, returns an error message or None
+def check_selection(top, rank):
+    if top is not None and (not top.isnumeric() or int(top) < 1):
+        return "'--top' must be a positive integer."
+    if rank is not None and rank not in RANKINGS:
+        return f"Invalid rank. Choose one of: {', '.join(RANKINGS)}."
+    return None
+
+
+compare_help = ("Usage: --compare (-m METRIC [-t key=value ...] | PRESET) ... [-f FROMTIME] [-e ENDTIME] [-nr] "
+                "[-ds FUNCTION] [--top K] [--rank max|mean|p99] [--layout stacked|dual]<br>"
+                "Graphs several metrics in one image. Tags apply to the metric before them. "
+                "'dual' puts two metrics on left and right axes of one plot.")
+
+
+# parses '--compare', fetches every metric at the same time and returns the data for one shared render
+def parse_compare(arg):
+    if len(arg) == 0 or arg[0] in ['-h', '--help']:
+        return 1, 0, compare_help
+    groups = []
+    times = {"fromtime": "1d-ago",
+             "endtime": datetime.datetime.strftime(datetime.datetime.now(), "%Y/%m/%d-%H:%M:%S")}
+    rate = True
+    downsample = None
+    selection = {"top": None, "rank": None}
+    layout = "stacked"
+    i = 0
+    while i < len(arg):
+        word = arg[i]
+        value = arg[i + 1] if i + 1 < len(arg) else None
+        if word in ["-nr", "--norate"]:
+            rate = False
+            i += 1
+            continue
+        if word in presets:
+            preset = presets[word][0]
+            tags = {"dc": "*"} if preset['full_name'] == "tsunami.hbase.read.duration" else {}
+            groups += [{"metric": preset['full_name'], "tags": tags, "downsample": preset['downsample']}]
+            i += 1
+            continue
+        if value is None:
+            return 1, 0, f"'{word}' must be followed by a value. Type '--compare -h' for options."
+        if word in ["-m", "--metric"]:
+            groups += [{"metric": value, "tags": {}, "downsample": "avg"}]
+        elif word in ["-t", "--tags"]:
+            if len(groups) == 0:
+                return 1, 0, "Tags must follow the metric they apply to."
+            if not validate_tags(value, groups[-1]['tags']) or not check_dc(groups[-1]['tags']):
+                return 1, 0, "Invalid tag format. Format for tags: key=value. "
+        elif word in ["-f", "--fromtime", "-e", "--endtime"]:
+            if not check_regex_date(value) and not check_time_format(value):
+                return 1, 0, "Time format invalid. Correct format: 'yyyy/mm/dd-HH:MM:SS' or 'time-ago'."
+            times["fromtime" if word in ["-f", "--fromtime"] else "endtime"] = value
+        elif word in ["-ds", "--downsample"]:
+            if value not in FUNCTIONS:
+                return 1, 0, f"Invalid downsample function. Choose one of: {', '.join(FUNCTIONS)}."
+            downsample = value
+        elif word in ["-top", "--top", "-rank", "--rank"]:
+            selection[word.strip("-")] = value
+        elif word == "--layout":
+            if value not in ["stacked", "dual"]:
+                return 1, 0, "Layout must be 'stacked' or 'dual'."
+            layout = value
+        else:
+            return 1, 0, f"Unrecognized argument '{word}'. Type '--compare -h' for options."
+        i += 2
+    em = check_selection(selection['top'], selection['rank'])
+    if em:
+        return 1, 0, em
+    if len(groups) < 2:
+        return 1, 0, "'--compare' needs at least two metrics."
+    if len(groups) > int(props.get('compare_max_metrics', 4)):
+        return 1, 0, f"'--compare' takes at most {props.get('compare_max_metrics', 4)} metrics."
+    if layout == "dual" and len(groups) != 2:
+        return 1, 0, "'--layout dual' takes exactly two metrics."
+    urls = [planned_url(times['fromtime'], times['endtime'], g['metric'], g['tags'], rate,
+                        downsample if downsample else g['downsample']) for g in groups]
+    print("Urls: ", urls)
+    datas = fetch_all(urls)
+    for g, data in zip(groups, datas):
+        # tsdb answers an unknown metric with an error object instead of a list
+        if type(data) is not list:
+            return 1, 0, f"Metric invalid: {g['metric']}. Please type a valid metric. "
+        if len(data) == 0:
+            return 1, 0, f"No data for {g['metric']} with tags {g['tags']}. "
+    print("Creating graph...")
+    top = int(selection['top']) if selection['top'] else None
+    return 3, {"data": datas, "layout": layout, "top": top, "rank": selection['rank']}, 0
+
+
 # configures commands and returns the proper payload
 def parse_message(message):
     print("Argument received. Checking for errors...")
     arg = strip_space(message)
+    if arg[0] == "--compare":
+        return parse_compare(arg[1:])
+    # next page of a '--PI' listing
+    if arg[0] == "--more":
+        return 1, 0, more_function(arg[1:])
     # activates PI support mode
     if arg[0] == "--PI":
         parser = set_commands_for_PI(spec_args)
@@ -148,6 +264,8 @@ def parse_message(message):
     times = {"fromtime": "1d-ago",
              "endtime": datetime.datetime.strftime(datetime.datetime.now(), "%Y/%m/%d-%H:%M:%S")}
     rate = True
+    downsample = None
+    selection = {"top": None, "rank": None}
     # validates tag, if anything is wrong, invalid = True
     for i in range(len(arg)):
         # check for norate command
@@ -166,6 +284,20 @@ def parse_message(message):
             if not check_regex_date(endtime) and not check_time_format(endtime):
                 return 1, 0, 0
             times['endtime'] = endtime
+        # check downsample function
+        elif arg[i] == "-ds" or arg[i] == "--downsample":
+            if i + 1 >= len(arg) or arg[i + 1] not in FUNCTIONS:
+                em = f"Invalid downsample function. Choose one of: {', '.join(FUNCTIONS)}."
+                return 1, 0, em
+            downsample = arg[i + 1]
+        # check series selection options
+        elif arg[i] in ["-top", "--top", "-rank", "--rank"]:
+            if i + 1 >= len(arg):
+                return 1, 0, f"'{arg[i]}' must be followed by a value."
+            selection[arg[i].strip("-")] = arg[i + 1]
+            em = check_selection(selection['top'], selection['rank'])
+            if em:
+                return 1, 0, em
         # input tags, check for validity
         elif arg[i] == "-t" or arg[i] == "--tags":
             tag = arg[i + 1]
@@ -179,6 +311,7 @@ def parse_message(message):
                     em = "Invalid datacenter. Please enter a non-numeric datacenter."
                     return 1, 0, em
     # argument is valid
+    graph_options = {"top": int(selection['top']) if selection['top'] else None, "rank": selection['rank']}
     argname = arg[0]
     if argname in presets:
         print("Preset")
@@ -187,13 +320,14 @@ def parse_message(message):
         if name == "tsunami.hbase.read.duration":
             tags['dc'] = "*"
             times['fromtime'] = "6h-ago"
-        url = MetricGraph.get_url_for_metric_tag(times['fromtime'], times['endtime'], name, tags, rate, True)
+        function = downsample if downsample else presets[argname][0]['downsample']
+        url = planned_url(times['fromtime'], times['endtime'], name, tags, rate, function)
         print("Url: ", url)
         print("Creating graph...")
         if check_data(url) == 1:
             return 1, 0, 0
         else:
-            return 2, url, 0
+            return 2, dict(url=url, **graph_options), 0
     else:
         print('Specify')
         try:
@@ -212,15 +346,15 @@ def parse_message(message):
             else:
                 args = parser.parse_args(arg)
                 met = args.__dict__['metric']
-                spec_url = MetricGraph.get_url_for_metric_tag(times['fromtime'], times['endtime'], met, tags, rate,
-                                                              True)
+                spec_url = planned_url(times['fromtime'], times['endtime'], met, tags, rate,
+                                       downsample if downsample else "avg")
                 if check_data(spec_url) == 1:
                     em = "Invalid combination of metric and tag. "
                     return 1, 0, em
                 else:
                     print("Url: ", spec_url)
                     print("Creating graph...")
-                    return 2, spec_url, 0
+                    return 2, dict(url=spec_url, **graph_options), 0
         except:
             em = "Error: command unrecognized. Type -h for more information."
             return 1, 0, em
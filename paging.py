@@ -0,0 +1,72 @@
+import json
+import secrets
+import sqlite3
+import time
+
+
+# keeps the rows of long listings in SQLite so later pages are served without another query
+# the store is shared by every bot instance, so '--more' works whichever instance picks the message up
+# a cursor is '<listing>-<page>', so asking for the same cursor twice gives the same page
+class PageStore:
+    def __init__(self, path, page_size=10, ttl=600, max_listings=100):
+        self.path = path
+        self.page_size = page_size
+        self.ttl = ttl
+        self.max_listings = max_listings
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS pages ("
+                         "cursor_key TEXT PRIMARY KEY, "
+                         "header TEXT NOT NULL, "
+                         "rows TEXT NOT NULL, "
+                         "expires_at REAL NOT NULL)")
+
+    # one short-lived connection per call, so the store can be used from any thread or process
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def expire(self, conn):
+        conn.execute("DELETE FROM pages WHERE expires_at < ?", (time.time(),))
+        conn.execute("DELETE FROM pages WHERE cursor_key NOT IN "
+                     "(SELECT cursor_key FROM pages ORDER BY expires_at DESC LIMIT ?)", (self.max_listings,))
+
+    # stores a listing, returns the cursor of its second page (None if it fits on one page)
+    def add(self, header, rows):
+        if len(rows) <= self.page_size:
+            return None
+        conn = self.connect()
+        try:
+            while True:
+                key = secrets.token_hex(3)
+                cur = conn.execute("INSERT OR IGNORE INTO pages (cursor_key, header, rows, expires_at) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   (key, json.dumps(header), json.dumps(rows), time.time() + self.ttl))
+                if cur.rowcount == 1:
+                    break
+            self.expire(conn)
+        finally:
+            conn.close()
+        return f"{key}-2"
+
+    # returns (header, rows of the page, first row number, total rows, next cursor or None)
+    # or None when the cursor is unknown or has expired
+    def get(self, cursor):
+        key, _, page = cursor.partition("-")
+        if not page.isnumeric() or int(page) < 1:
+            return None
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT header, rows FROM pages WHERE cursor_key = ? AND expires_at >= ?",
+                               (key, time.time())).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        header, listing = json.loads(row[0]), json.loads(row[1])
+        start = (int(page) - 1) * self.page_size
+        rows = listing[start:start + self.page_size]
+        if len(rows) == 0:
+            return None
+        more = f"{key}-{int(page) + 1}" if start + self.page_size < len(listing) else None
+        return header, rows, start + 1, len(listing), more
@@ -0,0 +1,17 @@
+import os
+import sys
+from authentication import token
+
+# the watcher runs from this directory, shared modules live one level up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+config = {"token": token}
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "pichannel.properties")) as d:
+    lines = d.readlines()
+    for i in range(len(lines)):
+        line = lines[i]
+        if line != "\n" and line[0] != "#":
+            items = line.split("=", 1)
+            value = items[1][:-1]
+            config[items[0]] = value
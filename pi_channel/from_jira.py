@@ -1,77 +1,47 @@
+import math
+import time
 from srelib.jira.jql_request import JQLRequest
 from srelib.jira.pi_helper import PIHelper
-from processing import get_id
+from processing import get_assignee_name
 
 
-# gets all new PI tickets in a list
-def get_new_pi_tickets():
-    cctrl_helper = PIHelper()
-    jql = f"project = \"Production Issues\" and resolution = unresolved ORDER BY priority DESC, updated DESC"
-    jql_request = JQLRequest(jql, 0, 1000, "true", "assignee,status,creator,created,priority,updated,summary,customfield_12195", "",
-                                 "get")
-    search_results = cctrl_helper.submit_search(jql_request)
-    return search_results.get_issues()
+# one helper (and its connections) shared by every project's searches
+cctrl_helper = PIHelper()
 
+PAGE_SIZE = 1000
 
-# formats the desired information from the PI ticket
-def get_info(ticket):
-    cctrl_helper = PIHelper()
-    jql = "project = \"Production Issues\" and resolution = unresolved ORDER BY priority DESC, updated DESC"
-    jql_request = JQLRequest(jql, 0, 1000, "true", "assignee,status,creator,created,priority,updated,summary", "",
-                             "get")
-    search_results = cctrl_helper.submit_search(jql_request)
-    for id in search_results.get_issues():
-        if get_id(str(id)) == get_id(str(ticket)):
-            priority = id.get_priority().get_name()
-            name = id.get_assignee().get_display_name()
-            title = id.get_summary()
-            return [name, id, title, priority]
+FIELDS = ["assignee", "status", "creator", "created", "priority", "updated", "summary", "resolution"]
 
 
-# checks to see if priority change meets criteria to be posted
-# if change goes to Blocker or High
-def do_i_post_priority(ticket):
-    priority = ticket.get_priority().get_name()
-    severe_state = False
-    change = False
-    with open("processed_tickets.txt", "r") as f:
-        lines = f.readlines()
-        for i in lines:
-            old_priority = i.split(",")[1]
-            if old_priority in ['Blocker', 'High']:
-                severe_state = True
-    if not severe_state:
-        if priority in ['Blocker', 'High']:
-            change = True
+# gets a project's tickets in a list, a page of PAGE_SIZE at a time
+# without 'since' it's a full sweep of the unresolved tickets, with it only the tickets updated since then,
+# resolved ones included so their resolution is seen
+# 'since' goes to Jira as a relative bound ('-Nm'), since absolute JQL dates are read in the search user's timezone
+def get_tickets(project, fields, since=None):
+    if since is None:
+        # ordered by key within a priority so a ticket updated mid-sweep doesn't move between pages
+        jql = f"project = \"{project}\" and resolution = unresolved ORDER BY priority DESC, key ASC"
     else:
-        if priority == "Blocker":
-            change = True
-    return change
+        minutes = math.ceil(max(0, time.time() - since) / 60)
+        jql = f"project = \"{project}\" and updated >= -{minutes}m ORDER BY updated DESC, key ASC"
+    tickets = []
+    while True:
+        jql_request = JQLRequest(jql, len(tickets), PAGE_SIZE, "true", ",".join(dict.fromkeys(FIELDS + fields)), "",
+                                 "get")
+        page = cctrl_helper.submit_search(jql_request).get_issues()
+        # Jira may cap maxResults below PAGE_SIZE, so only an empty page ends the search
+        if len(page) == 0:
+            return tickets
+        tickets += page
 
 
-# checks if change meets criteria to be posted
-# if impact is changed to Severe 1 or 2
-def do_i_post_impact(ticket):
-    new_impact = ticket.get_value(['fields', 'customfield_12195'])
-    new_impact = new_impact['value'] if new_impact is not None else "None"
-    # new_impact = "Severity 1"
-    ticket_id = get_id(str(ticket))
-    severe_state = False
-    change = False
-    with open("processed_tickets.txt", "r") as f:
-        lines = f.readlines()
-        for i in lines:
-            info = i.split(",")
-            if ticket_id == info[0]:
-                old_impact = info[2][:-1]
-                if old_impact in ['Severity 1', 'Severity 2']:
-                    severe_state = True
-    if severe_state:
-        if new_impact == "Severity 1" and old_impact == "Severity 2":
-            change = True
-    else:
-        if new_impact in ['Severity 1', 'Severity 2']:
-            change = True
-    return change
+# formats the desired information from the ticket
+def get_info(ticket):
+    priority = ticket.get_priority().get_name()
+    name = get_assignee_name(ticket)
+    title = ticket.get_summary()
+    return [name, ticket, title, priority]
 
 
+def is_resolved(ticket):
+    return ticket.get_value(['fields', 'resolution']) is not None
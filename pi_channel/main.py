@@ -1,40 +1,124 @@
-from from_jira import get_info, get_new_pi_tickets, do_i_post_impact, do_i_post_priority
-from to_teams import post_info, create_priority_message, create_impact_message
-from processing import process_ticket, is_ticket_processed, check_priority, change_priority, check_impact, change_impact
-
-
-# adds all the functions together into one
-def driver():
-    all_info = []
-    # iterates through all tickets
-    for i in get_new_pi_tickets():
-
-        if not is_ticket_processed(i):
-            all_info += [get_info(i)]
-            process_ticket(i)
-
-        if not check_priority(i):
-            print("priority changed")
-            if do_i_post_priority(i):
-                post_info(create_priority_message(i))
-            change_priority(i)
-
-        if not check_impact(i):
-            print('impact changed')
-            print(do_i_post_impact(i))
-            if do_i_post_impact(i):
-                print("criteria met")
-                post_info(create_impact_message(i))
-            change_impact(i)
-
-    # if anything in the list
-    if len(all_info) > 0:
-        # post list of all previously unprocessed tickets
-        post_info(all_info)
-    return
-
-
-while True:
-    driver()
-    # time.sleep(5)
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from from_jira import get_info, get_tickets, is_resolved
+from to_teams import post_info, messages_url
+from processing import get_id, get_assignee_name, load_state, save_state
+from rules import RuleEngine
+from config import config
+from ticket_history import HistoryStore, opened_event, changed_event, resolved_event, jira_time
 
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+# one watched project: where it posts, its rules, and its own state and history
+class ProjectWatch:
+    def __init__(self, settings, histories):
+        self.name = settings['name']
+        self.project = settings['project']
+        self.url = messages_url(settings['teams_id'], settings['channel_id'])
+        self.engine = RuleEngine.from_file(os.path.join(here, settings.get('rules', "rules.json")))
+        self.state_path = os.path.join(here, settings.get('state', f"processed_tickets_{self.name}.json"))
+        self.legacy_path = os.path.join(here, settings['legacy_state']) if settings.get('legacy_state') else None
+        self.history = histories.get(settings['history_path']) if settings.get('history_path') else None
+        self.last_poll = None
+        self.last_sweep = 0
+
+    # fields the search has to return for the rules
+    def fields(self):
+        return list(dict.fromkeys(path[1] for path in self.engine.fields.values()))
+
+    # adds all the functions together into one
+    # most polls only search tickets updated since the last one (with some overlap for Jira's minute resolution),
+    # every full_sweep seconds all unresolved tickets are searched, a page at a time, to catch anything the
+    # incremental searches missed
+    def driver(self, now):
+        sweep = self.last_poll is None or now - self.last_sweep >= int(config.get('full_sweep', 3600))
+        since = None if sweep else self.last_poll - int(config.get('poll_overlap', 120))
+        tickets = get_tickets(self.project, self.fields(), since)
+        all_info = []
+        events = []
+        # the stored state is read once, every watched field of every ticket is checked against it in one pass,
+        # and the state is written back once
+        state = load_state(self.state_path, self.legacy_path)
+        for i in tickets:
+            ticket_id = get_id(str(i))
+            if is_resolved(i):
+                if ticket_id in state:
+                    del state[ticket_id]
+                    events += [resolved_event(ticket_id)]
+                continue
+            values = self.engine.values(i)
+            priority = values.get('priority')
+            assignee = get_assignee_name(i)
+
+            if ticket_id not in state:
+                all_info += [get_info(i)]
+                events += [opened_event(ticket_id, priority, assignee, jira_time(i.get_create_date()))]
+            else:
+                for field, old, new, message in self.engine.evaluate(ticket_id, state[ticket_id], values):
+                    print(f"{self.name}: {field} changed")
+                    events += [changed_event(ticket_id, field, old, new, priority, assignee)]
+                    if message:
+                        print("criteria met")
+                        post_info(message, self.url)
+            state[ticket_id] = values
+
+        if sweep:
+            # tickets that dropped out of the unresolved search were resolved (or moved out of the project)
+            open_ids = set(get_id(str(i)) for i in tickets)
+            for ticket_id in [i for i in state if i not in open_ids]:
+                del state[ticket_id]
+                events += [resolved_event(ticket_id)]
+        save_state(self.state_path, state)
+        # the next incremental search starts from this poll only once its changes are stored
+        self.last_poll = now
+        if sweep:
+            self.last_sweep = now
+        if self.history is not None:
+            self.history.append(events)
+
+        # if anything in the list
+        if len(all_info) > 0:
+            # post list of all previously unprocessed tickets
+            post_info(all_info, self.url)
+        print(f"{self.name}: {len(tickets)} tickets {'swept' if sweep else 'updated'}, {len(events)} events.")
+
+
+# projects writing to the same history_path share one HistoryStore, so their appends go through one lock
+# and one set of dictionary codes instead of each assigning its own codes to the same dictionary files
+class HistoryStores:
+    def __init__(self):
+        self.stores = {}
+
+    def get(self, path):
+        key = os.path.realpath(path)
+        if key not in self.stores:
+            self.stores[key] = HistoryStore(path)
+        return self.stores[key]
+
+
+def load_projects():
+    histories = HistoryStores()
+    with open(os.path.join(here, config.get('projects_path', "projects.json"))) as d:
+        return [ProjectWatch(i, histories) for i in json.load(d)]
+
+
+# runs one poll of a project, a failure only skips that project until the next poll
+def poll(project, now):
+    try:
+        project.driver(now)
+    except Exception as e:
+        print(f"{project.name}: poll failed: {e}")
+
+
+if __name__ == "__main__":
+    projects = load_projects()
+    # every project is searched at the same time, through the one shared Jira helper
+    with ThreadPoolExecutor(max_workers=min(len(projects), int(config.get('jira_concurrency', 4)))) as pool:
+        while True:
+            started = time.time()
+            list(pool.map(lambda p: poll(p, started), projects))
+            time.sleep(max(0, int(config.get('poll_interval', 60)) - (time.time() - started)))
@@ -0,0 +1,72 @@
+import json
+
+
+# a rule's from/to set: listed values, '*' for any value, '!value' to leave a value out
+class ValueSet:
+    def __init__(self, values):
+        self.any = "*" in values
+        self.only = set(i for i in values if i != "*" and not i.startswith("!"))
+        self.excluded = set(i[1:] for i in values if i.startswith("!"))
+
+    def __contains__(self, value):
+        if value in self.excluded:
+            return False
+        return self.any or value in self.only
+
+
+# reads a value out of a ticket's raw json, 'None' when any part of the path is missing
+def field_value(ticket, path):
+    value = ticket.get_value(path[:2])
+    for key in path[2:]:
+        value = value.get(key) if isinstance(value, dict) else None
+    return str(value) if value is not None else "None"
+
+
+# notification rules compiled into a transition table: (field, old value, new value) -> message template
+# the table fills in as transitions are seen, so each distinct change is matched against the rules once
+class RuleEngine:
+    def __init__(self, fields, rules):
+        self.fields = fields
+        self.rules = {}
+        for rule in rules:
+            if rule['field'] not in fields:
+                raise ValueError(f"Rule for unwatched field '{rule['field']}'")
+            self.rules.setdefault(rule['field'], []).append(
+                [ValueSet(rule['from']), ValueSet(rule['to']), rule['template']])
+        self.table = {}
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as d:
+            config = json.load(d)
+        return cls(config['fields'], config['rules'])
+
+    # every watched field of a ticket, as stored in the state file
+    def values(self, ticket):
+        return {field: field_value(ticket, path) for field, path in self.fields.items()}
+
+    # message template for a change, None when no rule posts it (the first matching rule wins)
+    def template(self, field, old, new):
+        key = (field, old, new)
+        if key not in self.table:
+            self.table[key] = None
+            for from_set, to_set, template in self.rules.get(field, []):
+                if old in from_set and new in to_set:
+                    self.table[key] = template
+                    break
+        return self.table[key]
+
+    # compares a ticket's stored and current values in one pass over the watched fields
+    # returns [field, old, new, message or None] for every field that changed
+    def evaluate(self, ticket_id, old, new):
+        changes = []
+        for field in self.fields:
+            # a field watched since the ticket was stored has no old value, it's recorded without a change
+            if field not in old or old[field] == new[field]:
+                continue
+            before = old[field]
+            after = new[field]
+            template = self.template(field, before, after)
+            message = template.format(id=ticket_id, field=field, old=before, new=after) if template else None
+            changes += [[field, before, after, message]]
+        return changes
@@ -5,7 +5,7 @@ class ticket():
     def __init__(self):
         self.id = "id = PI-5344"
         self.old_impact = "None"
-        self.new_impact = "Severe 1"
+        self.new_impact = "Severity 1"
         self.old_priority = "Low"
         self.new_priority = "Medium"
         self.new = False
@@ -1,33 +1,17 @@
+import os
+import sys
 
+# the rule engine and its rules live one level up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rules import RuleEngine
+
+
+engine = RuleEngine.from_file(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rules.json"))
 
 
 def do_i_change_priority_test(ticket):
-    priority = ticket.new_priority
-    severe_state = False
-    change = False
-    old_priority = ticket.old_priority
-    if old_priority in ['Blocker', 'High']:
-        severe_state = True
-    if not severe_state:
-        if priority in ['Blocker', 'High']:
-            change = True
-    else:
-        if priority == "Blocker" and old_priority == "High":
-            change = True
-    return change
+    return engine.template("priority", ticket.old_priority, ticket.new_priority) is not None
 
 
 def do_i_change_impact_test(ticket):
-    new_impact = ticket.new_impact
-    old_impact = ticket.old_impact
-    severe_state = False
-    change = False
-    if old_impact in ['Severe 1', 'Severe 2']:
-        severe_state = True
-    if severe_state:
-        if new_impact == "Severe 1" and old_impact == "Severe 2":
-            change = True
-    else:
-        if new_impact in ['Severe 1', 'Severe 2']:
-            change = True
-    return change
+    return engine.template("impact", ticket.old_impact, ticket.new_impact) is not None
@@ -1,6 +1,8 @@
-import requests
-from authentication import token
-from processing import get_id
+from config import config
+from token_provider import TokenProvider
+
+
+token_provider = TokenProvider.from_props(config)
 
 
 # post function for messages
@@ -11,32 +13,16 @@ def post_message(message, channel_url):
             "content": f"<div>{message}</div>"
         },
     }
-    headers = {
-                "Content-type": "application/json",
-                "Authorization": token
-               }
-    return requests.post(channel_url, json=json_payload, headers=headers)
+    headers = {"Content-type": "application/json"}
+    return token_provider.request("POST", channel_url, json=json_payload, headers=headers)
 
 
-# posts the info to the teams channel
-def post_info(info):
-    teams_id = "ea7db30e-e76a-4c9b-b95a-6ccc8911f83a"
-    channel_id = "19%3a7207ce83252247d79174f1ab53f64fb0%40thread.tacv2"
+# url of a channel's messages
+def messages_url(teams_id, channel_id):
     base = "https://graph.microsoft.com/v1.0/"
-    url = f"{base}teams/{teams_id}/channels/{channel_id}/messages"
-    return post_message(info, url)
-
-
-# formats messages to send to Teams channel
-def create_priority_message(ticket):
-    id = get_id(str(ticket))
-    pri = ticket.get_priority().get_name()
-    return f"Ticket \"{id}\" priority changed to {pri}"
-
-
-def create_impact_message(ticket):
-    id = get_id(str(ticket))
-    impact = ticket.get_value(['fields', 'customfield_12195'])
-    return f"Ticket \"{id}\" impact changed to {impact}"
+    return f"{base}teams/{teams_id}/channels/{channel_id}/messages"
 
 
+# posts the info to the teams channel
+def post_info(info, url):
+    return post_message(info, url)
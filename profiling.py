@@ -0,0 +1,126 @@
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import threading
+import time
+
+
+# functions always listed in the report, when they ran during the capture
+WATCHED = "parse_message|parse_compare|brian_function|graphdata|graph_panels|render_png|render_panels|encode_image"
+
+session = None
+session_lock = threading.Lock()
+
+
+# wraps a stats dict (from a render worker) so pstats can load it like a Profile
+class StatsHolder:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class ProfileSession:
+    def __init__(self, channel_url, until=None, commands=None):
+        self.channel_url = channel_url
+        self.until = until
+        self.commands = commands
+        self.profiled = 0
+        self.skipped = 0
+        self.stats = None
+        self.started = time.time()
+        self.lock = threading.Lock()
+        # only one command is profiled at a time, others run unprofiled while it does
+        self.running = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def is_done(self):
+        if self.until is not None and time.time() >= self.until:
+            return True
+        return self.commands is not None and self.profiled >= self.commands
+
+
+# runs one command handler, profiled when a capture is on
+# callers check 'session is not None' first, so nothing here runs while profiling is off
+def profile_call(fn, *args):
+    current = session
+    if current is None or not current.running.acquire(blocking=False):
+        if current is not None:
+            current.skipped += 1
+        return fn(*args)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(fn, *args)
+    finally:
+        current.running.release()
+        current.profiled += 1
+        current.add(profile)
+
+
+# merges stats sent back by a render worker into the current capture
+def add_worker_stats(stats):
+    current = session
+    if current is not None and stats:
+        current.add(StatsHolder(stats))
+
+
+# parses '--debug profile <60s|5m|N|stop>', returns the reply
+def command(words, user_id, channel_url, admins, profile_dir="."):
+    global session
+    if user_id not in admins:
+        return "'--debug' is only available to bot admins."
+    if len(words) < 3 or words[1] != "profile":
+        return "Usage: --debug profile &lt;60s | 5m | N commands | stop&gt;"
+    spec = words[2]
+    if spec == "stop":
+        report = finish(force=True, profile_dir=profile_dir)
+        return report[1] if report else "No profile is running."
+    with session_lock:
+        if session is not None:
+            return "A profile is already running. Use '--debug profile stop' to end it."
+        if spec.isnumeric():
+            session = ProfileSession(channel_url, commands=int(spec))
+            return f"Profiling the next {spec} commands."
+        if len(spec) > 1 and spec[:-1].isnumeric() and spec[-1] in ["s", "m"]:
+            seconds = int(spec[:-1]) * (60 if spec[-1] == "m" else 1)
+            session = ProfileSession(channel_url, until=time.time() + seconds)
+            return f"Profiling for {seconds} seconds."
+    return "Invalid profile length. Use e.g. '60s', '5m' or a number of commands."
+
+
+# ends the capture once its window or command count is used up
+# writes the full profile to disk and returns (channel url, report) to post, or None
+def finish(force=False, profile_dir="."):
+    global session
+    with session_lock:
+        current = session
+        if current is None or not (force or current.is_done()):
+            return None
+        session = None
+    if current.stats is None:
+        return current.channel_url, "Profile finished, no commands were captured."
+    filename = os.path.join(profile_dir, datetime.datetime.now().strftime("profile-%Y%m%d-%H%M%S.prof"))
+    # the session is already cleared, so a failed write only loses the file, not the report
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        current.stats.dump_stats(filename)
+    except OSError as e:
+        print(f"Profile could not be written: {e}")
+        filename = f"not written ({e})"
+    output = io.StringIO()
+    current.stats.stream = output
+    current.stats.sort_stats("cumulative").print_stats(20)
+    current.stats.print_stats(WATCHED)
+    text = output.getvalue().replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    header = (f"Profile of {current.profiled} commands over {time.time() - current.started:.0f} seconds "
+              f"({current.skipped} ran unprofiled while another was captured). Full profile: {filename}")
+    return current.channel_url, f"{header}<pre>{text}</pre>"
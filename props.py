@@ -7,7 +7,7 @@ with open("teamsbot.properties") as d:
     for i in range(len(lines)):
         line = lines[i]
         if line != "\n" and line[0] != "#":
-            items = line.split("=")
+            items = line.split("=", 1)
             value = items[1][:-1]
             props[items[0]] = value
 
@@ -0,0 +1,93 @@
+from srelib.metrics.visualization import MetricGraph
+import datetime
+import re
+import time
+from grapher import FIG_SIZE, DPI
+from props import props
+
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+# downsample intervals tsdb is asked for, smallest first
+INTERVALS = [["1m", 60], ["2m", 120], ["5m", 300], ["10m", 600], ["15m", 900], ["30m", 1800],
+             ["1h", 3600], ["2h", 7200], ["3h", 10800], ["6h", 21600], ["12h", 43200], ["1d", 86400],
+             ["1w", 604800]]
+
+FUNCTIONS = ["avg", "max", "min", "sum", "none"]
+
+DOWNSAMPLE_SPEC = re.compile(r"^\d+[smhdwny]-\w+")
+
+
+# converts a tsdb time ('6h-ago', 'yyyy/mm/dd-HH:MM:SS' or unix seconds/milliseconds) into unix seconds
+def parse_time(time_string, now=None):
+    now = now if now else time.time()
+    if time_string.isnumeric():
+        return int(time_string) / 1000 if len(time_string) > 10 else int(time_string)
+    if time_string.endswith("-ago"):
+        amount = time_string[:-5]
+        return now - int(amount) * UNITS[time_string[-5]]
+    for fmt in ["%Y/%m/%d-%H:%M:%S", "%Y/%m/%d-%H:%M", "%Y/%m/%d"]:
+        try:
+            return datetime.datetime.strptime(time_string, fmt).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized time '{time_string}'")
+
+
+def window_seconds(fromtime, endtime, now=None):
+    return parse_time(endtime, now) - parse_time(fromtime, now)
+
+
+# picks the smallest interval that keeps the point count at or under the chart width
+# returns None when raw points already fit
+def pick_interval(seconds, width):
+    wanted = seconds / width
+    if wanted <= int(props.get('tsdb_resolution', 60)):
+        return None
+    for name, length in INTERVALS:
+        if length >= wanted:
+            return name
+    return INTERVALS[-1][0]
+
+
+# inserts a downsample spec after the aggregator of every 'm=' sub query, keeping rate and tag parts as they are
+def add_downsample(url, spec):
+    if "?" not in url:
+        return url
+    base, query = url.split("?", 1)
+    params = query.split("&")
+    for n, param in enumerate(params):
+        if not param.startswith("m="):
+            continue
+        value = param[2:]
+        sep = ":" if ":" in value else "%3A"
+        parts = value.split(sep)
+        if len(parts) < 2 or any(DOWNSAMPLE_SPEC.match(i) for i in parts[1:-1]):
+            continue
+        params[n] = "m=" + sep.join([parts[0], spec] + parts[1:])
+    return base + "?" + "&".join(params)
+
+
+# points a url at the tsdb_base host when one is configured (e.g. a local stand-in)
+def with_tsdb_base(url):
+    if not props.get('tsdb_base'):
+        return url
+    parts = url.split("/", 3)
+    return props['tsdb_base'].rstrip("/") + ("/" + parts[3] if len(parts) > 3 else "")
+
+
+# builds the graph url for a metric, asking tsdb for about as many points as the chart is wide
+def planned_url(fromtime, endtime, metric, tags, rate, function="avg"):
+    url = with_tsdb_base(MetricGraph.get_url_for_metric_tag(fromtime, endtime, metric, tags, rate, True))
+    if function == "none":
+        return url
+    width = int(props.get('graph_width', FIG_SIZE[0] * DPI))
+    try:
+        seconds = window_seconds(fromtime, endtime)
+    except ValueError:
+        # a date format tsdb takes but parse_time doesn't, e.g. '2019-05-01', is queried as is
+        return url
+    interval = pick_interval(seconds, width)
+    if interval is None:
+        return url
+    return add_downsample(url, f"{interval}-{function}")
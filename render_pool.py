@@ -0,0 +1,116 @@
+import cProfile
+import multiprocessing
+import os
+import queue
+import threading
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+# runs in each worker process: matplotlib is imported and a figure created once, then reused for every render
+def worker_main(conn):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from grapher import FIG_SIZE, DPI, render_png, render_panels
+    from image_encoding import encode_image
+    fig = Figure(figsize=FIG_SIZE, dpi=DPI)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        graph, encoding, profile = task
+
+        def run():
+            png = render_panels(fig, **graph) if 'panels' in graph else render_png(fig, **graph)
+            return encode_image(png, **encoding) if encoding is not None else png
+
+        try:
+            if profile:
+                profiler = cProfile.Profile()
+                result = profiler.runcall(run)
+                profiler.create_stats()
+                conn.send((True, result, profiler.stats))
+            else:
+                conn.send((True, run(), None))
+        except Exception as e:
+            conn.send((False, repr(e), None))
+
+
+class RenderWorker:
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class RenderPool:
+    def __init__(self, size=None, timeout=30):
+        # spawn keeps the workers free of the parent's threads and open connections
+        self.context = multiprocessing.get_context("spawn")
+        self.size = size if size else os.cpu_count()
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        for i in range(self.size):
+            self.idle.put(RenderWorker(self.context))
+
+    # renders one graph on the next free worker
+    # returns the png bytes, or an EncodedImage if encoding options (see encode_image) are given
+    # with profile set, returns (result, cProfile stats of the render) instead
+    # a render that runs past the timeout has its worker killed and replaced
+    def render(self, graph, encoding=None, timeout=None, profile=False):
+        timeout = timeout if timeout else self.timeout
+        worker = self.idle.get()
+        try:
+            worker.conn.send((graph, encoding, profile))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = RenderWorker(self.context)
+                raise RenderTimeout(f"render took longer than {timeout} seconds")
+            ok, result, stats = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            worker.kill()
+            worker = RenderWorker(self.context)
+            raise RenderError(f"render worker died: {e}")
+        finally:
+            self.idle.put(worker)
+        if not ok:
+            raise RenderError(result)
+        if profile:
+            return result, stats
+        return result
+
+    def close(self):
+        for i in range(self.size):
+            worker = self.idle.get()
+            worker.conn.send(None)
+            worker.process.join()
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+# the pool is started on first use, so importing this module stays cheap
+def get_pool(size=None, timeout=30):
+    global pool
+    if pool is None:
+        with pool_lock:
+            if pool is None:
+                pool = RenderPool(size, timeout)
+    return pool
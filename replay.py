@@ -0,0 +1,184 @@
+import argparse
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import numpy as np
+from props import props
+import stand_ins
+
+
+"""
+Desc: replays recorded channel messages through the whole bot (check_new_messages -> parse_message -> post)
+      against local Graph/TSDB/Jira stand-ins, and reports throughput, latency and error rates
+Usage: python replay.py --rate 2 --count 200 [--mix synthetic] [--poisson]
+Note: srelib's PIHelper reads its own Jira settings, so the replay swaps it for a client of the Jira stand-in
+      and '--PI' searches never reach the real Jira
+"""
+
+
+# phrases the bot uses in replies to commands it couldn't answer
+ERROR_PHRASES = ["Error", "error", "invalid", "Invalid", "unrecognized", "could not", "Cannot", "must"]
+
+
+# reads the recorded corpus (message id -> [content, sender]) in the order the messages were sent
+def load_corpus(path, commands_only):
+    from message_parser import strip_space, presets
+    with open(path) as d:
+        corpus = json.load(d)
+    messages = []
+    for message_id in sorted(corpus, key=lambda i: int(i) if i.isnumeric() else 0):
+        content, name = corpus[message_id]
+        words = strip_space(content)
+        if len(words) == 0:
+            continue
+        if commands_only and not (words[0].startswith("-") or words[0] in presets):
+            continue
+        messages += [[content, name]]
+    return messages
+
+
+# groups messages by their first word, for the per-command report
+def command_type(content):
+    from message_parser import strip_space, presets
+    words = strip_space(content)
+    word = words[0] if words else ""
+    if word in presets:
+        return "preset"
+    if word in ["-m", "--metric"]:
+        return "--metric"
+    if word.startswith("-"):
+        return word
+    return "other"
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return "n/a"
+    p = np.percentile(values, [50, 95, 99])
+    return f"p50 {p[0]:.2f}s  p95 {p[1]:.2f}s  p99 {p[2]:.2f}s  max {max(values):.2f}s"
+
+
+# points the bot at the stand-ins and at throwaway state files
+def configure(graph_url, tsdb_url, jira_url, workdir, poll, user_rate):
+    with open(os.path.join(workdir, "processed.json"), "w") as d:
+        json.dump({}, d)
+    with open(os.path.join(workdir, "srelib_credentials.json"), "w") as d:
+        replay = base64.b64encode(b"replay").decode("utf-8")
+        json.dump({"credentials": [{"u": replay, "p": replay}]}, d)
+    props.update({"base_url": graph_url,
+                  "tsdb_base": tsdb_url,
+                  "jira_api_base": jira_url + "/rest/api/2/issue",
+                  "processed_filepath": os.path.join(workdir, "processed.json"),
+                  "lease_filepath": os.path.join(workdir, "leases.db"),
+                  "watch_filepath": os.path.join(workdir, "watches.db"),
+                  "pi_history_path": os.path.join(workdir, "pi_history"),
+                  "profile_dir": workdir,
+                  "credentials": workdir,
+                  "query_time": str(poll),
+                  "user_rate": str(user_rate),
+                  "user_burst": str(max(5, user_rate))})
+
+
+def run(args):
+    graph, graph_url = stand_ins.start(stand_ins.GraphStandIn)
+    tsdb, tsdb_url = stand_ins.start(stand_ins.TSDBStandIn)
+    jira, jira_url = stand_ins.start(stand_ins.JiraStandIn)
+    print(f"Graph stand-in: {graph_url}  TSDB stand-in: {tsdb_url}  Jira stand-in: {jira_url}")
+    workdir = tempfile.mkdtemp(prefix="sre_bot_replay_")
+    configure(graph_url, tsdb_url, jira_url, workdir, args.poll, args.user_rate)
+
+    # the bot builds its clients from props when imported, so it's only imported once props point at the stand-ins
+    import main
+    import brian_PI
+    stand_ins.PIHelperStandIn.url = jira_url
+    brian_PI.PIHelper = stand_ins.PIHelperStandIn
+    main.start_render_pool()
+
+    corpus = load_corpus(args.corpus, args.commands_only or args.mix == "synthetic")
+    if args.mix == "synthetic":
+        rng = random.Random(args.seed)
+        messages = [rng.choice(corpus) for i in range(args.count)]
+    else:
+        messages = corpus[:args.count]
+
+    stop = threading.Event()
+
+    def bot():
+        while not stop.is_set():
+            try:
+                main.poll()
+            except Exception as e:
+                print(f"Poll failed: {e}")
+            stop.wait(args.poll)
+
+    bots = [threading.Thread(target=bot, daemon=True) for i in range(args.instances)]
+    for i in bots:
+        i.start()
+
+    sent = {}
+    rng = random.Random(args.seed)
+    start = time.time()
+    due = start
+    for n, (content, name) in enumerate(messages):
+        due += rng.expovariate(args.rate) if args.poisson else 1 / args.rate
+        time.sleep(max(0, due - time.time()))
+        message_id = str(int(start * 1000) + n)
+        sent[message_id] = [time.time(), content]
+        stand_ins.GraphStandIn.inject(message_id, content, name)
+    fed = time.time() - start
+
+    deadline = time.time() + args.drain
+    while time.time() < deadline and len(stand_ins.GraphStandIn.replies) < len(sent):
+        time.sleep(0.1)
+    stop.set()
+    elapsed = time.time() - start
+
+    latencies = []
+    by_type = {}
+    errors = 0
+    for message_id, (t, content) in sent.items():
+        replies = stand_ins.GraphStandIn.replies.get(message_id)
+        kind = command_type(content)
+        by_type.setdefault(kind, [])
+        if not replies:
+            continue
+        latency = replies[0][0] - t
+        latencies += [latency]
+        by_type[kind] += [latency]
+        body = replies[0][1]
+        if "hostedContents" not in body and any(i in body['body']['content'] for i in ERROR_PHRASES):
+            errors += 1
+    answered = len(latencies)
+    unanswered = len(sent) - answered
+    print("-"*40)
+    print(f"Replayed {len(sent)} messages in {fed:.1f}s ({len(sent) / fed:.2f} msg/s offered), "
+          f"drained after {elapsed:.1f}s")
+    print(f"Throughput: {answered / elapsed:.2f} replies/s")
+    print(f"Latency: {percentiles(latencies)}")
+    print(f"Error replies: {errors} ({100 * errors / max(1, len(sent)):.1f}%)  "
+          f"Unanswered: {unanswered} ({100 * unanswered / max(1, len(sent)):.1f}%)")
+    for kind in sorted(by_type, key=lambda i: -len(by_type[i])):
+        values = by_type[kind]
+        print(f"  {kind:<14} {len(values):>5} answered  {percentiles(values)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded bot traffic against local stand-ins.")
+    parser.add_argument("--corpus", default="pr_me.txt", help="Recorded messages (message id -> [content, sender]).")
+    parser.add_argument("--mix", choices=["corpus", "synthetic"], default="corpus",
+                        help="Replay the corpus in order, or draw commands from it at random.")
+    parser.add_argument("--count", type=int, default=200, help="Number of messages to send.")
+    parser.add_argument("--rate", type=float, default=1.0, help="Messages per second.")
+    parser.add_argument("--poisson", action="store_true", help="Random (Poisson) arrivals instead of a steady rate.")
+    parser.add_argument("--commands-only", action="store_true", help="Skip corpus messages that aren't commands.")
+    parser.add_argument("--instances", type=int, default=1, help="Polling loops to run.")
+    parser.add_argument("--poll", type=float, default=float(props['query_time']), help="Seconds between polls.")
+    parser.add_argument("--drain", type=float, default=60, help="Seconds to wait for replies after the last message.")
+    parser.add_argument("--user-rate", type=float, default=1000,
+                        help="Per-user commands per second the bot allows (its own default would throttle the replay).")
+    parser.add_argument("--seed", type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,127 @@
+import threading
+import time
+import traceback
+from collections import deque
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    # seconds until a token is available, 0 if one is available now
+    def wait_time(self):
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+# one class of commands with its own worker threads
+# jobs queue per user and are dequeued by weighted fair queuing: the user with the lowest virtual time whose
+# token bucket has a token goes next, and each job moves that user's virtual time on by 1 / weight
+class Lane:
+    def __init__(self, name, workers, buckets, weights):
+        self.name = name
+        self.buckets = buckets
+        self.weights = weights
+        self.queues = {}
+        self.vtime = {}
+        self.clock = 0.0
+        self.condition = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def submit(self, user, job):
+        with self.condition:
+            if user not in self.queues:
+                self.queues[user] = deque()
+                # a user who was idle starts level with the others instead of with saved-up credit
+                self.vtime[user] = max(self.vtime.get(user, 0.0), self.clock)
+            self.queues[user].append(job)
+            self.condition.notify()
+
+    def pending(self):
+        with self.condition:
+            return sum(len(i) for i in self.queues.values())
+
+    # next job to run, or the seconds to wait until a rate-limited user has a token again
+    def next_job(self):
+        wait = None
+        for user in sorted(self.queues, key=lambda i: self.vtime[i]):
+            delay = self.buckets.wait_time(user)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            self.buckets.take(user)
+            job = self.queues[user].popleft()
+            self.clock = self.vtime[user]
+            self.vtime[user] += 1.0 / self.weights.get(user, 1.0)
+            if len(self.queues[user]) == 0:
+                del self.queues[user]
+            return job, None
+        return None, wait
+
+    def work(self):
+        while True:
+            with self.condition:
+                job, wait = self.next_job()
+                while job is None:
+                    self.condition.wait(wait)
+                    job, wait = self.next_job()
+            # a failing job must not take the lane's worker down with it
+            try:
+                job()
+            except Exception:
+                traceback.print_exc()
+
+
+# token buckets per user, shared by every lane so a user's rate limit covers all their commands
+class UserBuckets:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get(self, user):
+        if user not in self.buckets:
+            self.buckets[user] = TokenBucket(self.rate, self.burst)
+        return self.buckets[user]
+
+    def wait_time(self, user):
+        with self.lock:
+            return self.get(user).wait_time()
+
+    def take(self, user):
+        with self.lock:
+            self.get(user).take()
+
+
+class Scheduler:
+    def __init__(self, lanes, rate, burst, weights):
+        self.buckets = UserBuckets(rate, burst)
+        self.lanes = {name: Lane(name, workers, self.buckets, weights) for name, workers in lanes.items()}
+
+    def submit(self, lane, user, job):
+        self.lanes[lane].submit(user, job)
+
+
+# parses 'name:weight,name:weight' from teamsbot.properties
+def parse_weights(value):
+    weights = {}
+    for i in value.split(","):
+        if ":" in i:
+            name, weight = i.rsplit(":", 1)
+            weights[name.strip()] = float(weight)
+    return weights
@@ -0,0 +1,145 @@
+import re
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+import numpy as np
+from query_planner import parse_time, UNITS
+
+
+# a query's series kept as timestamp/value arrays, covering [start, end] of the windows fetched so far
+class CachedQuery:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.series = OrderedDict()
+
+    def size(self):
+        return sum(xs.nbytes + ys.nbytes for metric, tags, xs, ys in self.series.values())
+
+    # merges a tsdb response; per series, the points from the first timestamp the response returned on replace
+    # the cached ones, since the last (downsampled) point of the previous fetch may have been a partial bucket
+    # cached points before that are kept, e.g. the first bucket of a window that tsdb leaves out of a rate
+    def merge(self, data):
+        for d in data:
+            key = tuple(sorted(d['tags'].items()))
+            xs = np.fromiter(d['dps'].keys(), dtype=np.float64, count=len(d['dps']))
+            ys = np.fromiter(d['dps'].values(), dtype=np.float64, count=len(d['dps']))
+            if key in self.series:
+                metric, tags, old_xs, old_ys = self.series[key]
+                if len(xs) == 0:
+                    continue
+                keep = old_xs < xs[0]
+                xs = np.concatenate([old_xs[keep], xs])
+                ys = np.concatenate([old_ys[keep], ys])
+            self.series[key] = [d['metric'], d['tags'], xs, ys]
+
+    # drops points that fell out of the window
+    def trim(self, start):
+        for key in list(self.series):
+            metric, tags, xs, ys = self.series[key]
+            first = np.searchsorted(xs, start)
+            if first == len(xs):
+                del self.series[key]
+            elif first > 0:
+                self.series[key] = [metric, tags, xs[first:].copy(), ys[first:].copy()]
+        self.start = max(self.start, start)
+
+    # the window as a tsdb-like response, with 'dps' as a (timestamps, values) pair of arrays
+    def window(self, start, end):
+        result = []
+        for metric, tags, xs, ys in self.series.values():
+            lo, hi = np.searchsorted(xs, start), np.searchsorted(xs, end, side="right")
+            if hi > lo:
+                result += [{"metric": metric, "tags": tags, "dps": (xs[lo:hi], ys[lo:hi])}]
+        return result
+
+
+# caches tsdb query results per sub query (metric, tags, rate and downsample), fetching only what's missing:
+# a moving window like '1d-ago' costs a query from the last cached point to now instead of the whole day
+# entries are evicted least recently used first once they take more than 'budget' bytes
+class SeriesCache:
+    def __init__(self, budget, step=60):
+        self.budget = budget
+        self.step = step
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.tails = 0
+        self.misses = 0
+
+    # splits a query url into its cache key, window and point interval, None for urls that can't be cached
+    # the interval is the downsample interval, or the tsdb resolution ('step') for raw points
+    def parse(self, url, now):
+        if "?" not in url:
+            return None
+        base, query = url.split("?", 1)
+        params = urllib.parse.parse_qsl(query)
+        m = [v for k, v in params if k == "m"]
+        values = dict(params)
+        if len(m) != 1 or "start" not in values:
+            return None
+        try:
+            start = parse_time(values['start'], now)
+            end = parse_time(values['end'], now) if "end" in values else now
+        except (ValueError, KeyError):
+            return None
+        rest = [[k, v] for k, v in params if k not in ["start", "end"]]
+        interval = self.step
+        for part in m[0].split(":")[1:-1]:
+            spec = re.match(r"^(\d+)([smhdw])-", part)
+            if spec:
+                interval = int(spec.group(1)) * UNITS[spec.group(2)]
+        return (base, tuple(map(tuple, rest))), start, end, interval
+
+    # url for [start, end] of the same query, times as unix seconds
+    def window_url(self, key, start, end):
+        base, rest = key
+        params = [("start", str(int(start))), ("end", str(int(end)))] + list(rest)
+        return base + "?" + urllib.parse.urlencode(params, safe=":{}=,*|")
+
+    def get(self, url, fetch):
+        now = time.time()
+        parsed = self.parse(url, now)
+        if parsed is None:
+            return fetch(url)
+        key, start, end, interval = parsed
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if entry.start <= start and end <= entry.end:
+                    self.hits += 1
+                    return entry.window(start, end)
+        if entry is not None and entry.start <= start <= entry.end:
+            # only the tail is missing, fetched from the series that ends earliest, one interval back so a
+            # rate response (which leaves out its first point) still overlaps what is cached
+            with self.lock:
+                lasts = [xs[-1] for metric, tags, xs, ys in entry.series.values() if len(xs)]
+            since = max(min(lasts, default=entry.end) - interval, start)
+            data = fetch(self.window_url(key, since, end))
+            if type(data) is not list:
+                return data
+            self.tails += 1
+            with self.lock:
+                entry.merge(data)
+                entry.end = end
+                entry.trim(start)
+        else:
+            data = fetch(url)
+            if type(data) is not list:
+                return data
+            self.misses += 1
+            entry = CachedQuery(start, end)
+            entry.merge(data)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.evict()
+            return entry.window(start, end)
+
+    def evict(self):
+        total = sum(i.size() for i in self.entries.values())
+        while total > self.budget and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            total -= entry.size()
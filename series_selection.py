@@ -0,0 +1,56 @@
+import numpy as np
+import warnings
+
+
+RANKINGS = ["max", "mean", "p99"]
+
+
+# lines the series up on the union of their timestamps, missing points are NaN
+def align(series):
+    timestamps = np.unique(np.concatenate([xs for xs, ys in series]))
+    matrix = np.full((len(series), len(timestamps)), np.nan)
+    for row, (xs, ys) in enumerate(series):
+        matrix[row, np.searchsorted(timestamps, xs)] = ys
+    return timestamps, matrix
+
+
+def score(matrix, rank):
+    if rank == "mean":
+        return np.nanmean(matrix, axis=1)
+    if rank == "p99":
+        return np.nanpercentile(matrix, 99, axis=1)
+    return np.nanmax(matrix, axis=1)
+
+
+# score of every series on its own points, no alignment needed, so a large response can be ranked cheaply
+def series_scores(series, rank="max"):
+    scores = np.full(len(series), -np.inf)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for n, (xs, ys) in enumerate(series):
+            if len(ys):
+                scores[n] = score(np.asarray(ys, dtype=np.float64)[np.newaxis, :], rank)[0]
+    return np.nan_to_num(scores, nan=-np.inf)
+
+
+# indices of the n highest ranked series, in their original order
+def top_series(series, n, rank="max"):
+    return np.sort(np.argsort(-series_scores(series, rank), kind="stable")[:n])
+
+
+# keeps the k highest ranked series and folds the rest into one min/max band
+# returns the kept series and labels, and the band as (timestamps, low, high, label) or None
+def select_series(series, labels, k, rank="max"):
+    if len(series) <= k:
+        return series, labels, None
+    timestamps, matrix = align(series)
+    # a timestamp only some series have leaves NaN columns in the rest, those are expected
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        scores = np.nan_to_num(score(matrix, rank), nan=-np.inf)
+        order = np.argsort(-scores, kind="stable")
+        keep = np.sort(order[:k])
+        rest = order[k:]
+        band = (timestamps, np.nanmin(matrix[rest], axis=0), np.nanmax(matrix[rest], axis=0),
+                f"other ({len(rest)} series)")
+    return [series[i] for i in keep], [labels[i] for i in keep] if labels else [], band
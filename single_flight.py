@@ -0,0 +1,44 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+# runs one call per key at a time, callers asking for a key that is already running wait for that call's result
+# a finished result is also handed out for 'keep' seconds, so duplicates that were still queued behind the
+# first call (e.g. in a one-thread lane) don't repeat it
+class SingleFlight:
+    def __init__(self, keep=0):
+        self.keep = keep
+        self.calls = {}
+        self.finished = {}
+        self.lock = threading.Lock()
+        self.shared = 0
+
+    # returns (result, shared), shared is True when the result came from another caller's call
+    # an exception raised by the call is raised to every caller waiting on it, and is never kept
+    def do(self, key, fn, *args):
+        now = time.time()
+        with self.lock:
+            for k in [k for k, (t, f) in self.finished.items() if t < now]:
+                del self.finished[k]
+            future = self.calls.get(key)
+            if future is None and key in self.finished:
+                future = self.finished[key][1]
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result(), True
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+                if self.keep > 0 and future.exception() is None:
+                    self.finished[key] = (time.time() + self.keep, future)
+        return future.result(), False
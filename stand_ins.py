@@ -0,0 +1,209 @@
+import base64
+import json
+import re
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import requests
+from query_planner import parse_time, UNITS
+
+
+# local stand-ins for Microsoft Graph (and its token endpoint), TSDB and Jira (and srelib's Jira client),
+# used by replay.py and token_check.py
+# each one answers just the requests the bot makes, with canned but realistically sized data
+
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode("utf-8") if data is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+
+# channel messages are injected by the replay driver, replies are recorded with their arrival time
+class GraphStandIn(StandIn):
+    messages = []
+    replies = {}
+    lock = threading.Lock()
+
+    @classmethod
+    def inject(cls, message_id, content, name):
+        with cls.lock:
+            cls.messages.insert(0, {"id": message_id, "body": {"content": content},
+                                    "from": {"user": {"displayName": name, "id": f"replay-{name}"}}})
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        top = int(urllib.parse.parse_qs(url.query).get("$top", ["5"])[0])
+        with self.lock:
+            value = self.messages[:top]
+        self.send_json(200, {"value": value})
+
+    def do_POST(self):
+        match = re.search(r"/messages/([^/]+)/replies", self.path)
+        payload = self.read_json()
+        if match:
+            with self.lock:
+                self.replies.setdefault(match.group(1), []).append([time.time(), payload])
+        self.send_json(201, {"id": str(time.time())})
+
+
+# answers /api/query with one series per wildcard tag value, sized by the window and any downsample spec
+class TSDBStandIn(StandIn):
+    series_per_wildcard = 20
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        now = time.time()
+        start = parse_time(query.get("start", ["1d-ago"])[0], now)
+        end = parse_time(query["end"][0], now) if "end" in query else now
+        results = []
+        for m in query.get("m", []):
+            parts = m.split(":")
+            metric = parts[-1].split("{")[0]
+            tags = dict(i.split("=", 1) for i in re.findall(r"\{(.*)\}", parts[-1])[0].split(",")) \
+                if "{" in parts[-1] else {}
+            step = 60
+            for part in parts[1:-1]:
+                spec = re.match(r"^(\d+)([smhdw])-", part)
+                if spec:
+                    step = int(spec.group(1)) * UNITS[spec.group(2)]
+            # like tsdb, points sit on multiples of the (downsample) interval whatever the query start
+            xs = np.arange(-(-int(start) // step) * step, end, step).astype(np.int64)
+            wild = [k for k, v in tags.items() if v == "*"]
+            count = self.series_per_wildcard if wild else 1
+            for n in range(count):
+                series_tags = {k: (f"{k}{n}" if v == "*" else v) for k, v in tags.items()}
+                ys = 100 + 10 * n + 20 * np.sin(xs / 3600.0 + n)
+                results += [{"metric": metric, "tags": series_tags,
+                             "dps": {str(x): round(float(y), 3) for x, y in zip(xs, ys)}}]
+        self.send_json(200, results)
+
+
+# answers jira searches with a page of open tickets, lists the ticket assignees as users and accepts every assignment
+class JiraStandIn(StandIn):
+    tickets = 30
+
+    def do_GET(self):
+        if "/user/search" in self.path:
+            self.send_json(200, [{"name": f"user{n}", "displayName": f"User {n}", "emailAddress": f"user{n}@example.com",
+                                  "active": True} for n in range(5)])
+            return
+        issues = []
+        for n in range(self.tickets):
+            issues += [{"key": f"PI-{1000 + n}", "fields": {
+                "summary": f"Replay ticket {n}",
+                "created": "2021-07-28T15:04:05.000+0000",
+                "updated": "2021-07-28T15:04:05.000+0000",
+                "priority": {"name": ["Blocker", "High", "Medium", "Low"][n % 4]},
+                "status": {"name": "Open"},
+                "assignee": {"name": f"user{n % 5}", "displayName": f"User {n % 5}"},
+                "creator": {"name": "replay", "displayName": "Replay"},
+                "customfield_12195": None}}]
+        self.send_json(200, {"startAt": 0, "maxResults": len(issues), "total": len(issues), "issues": issues})
+
+    def do_PUT(self):
+        self.read_json()
+        self.send_json(204, None)
+
+
+# a client-credentials token endpoint ('POST /token') and a resource ('GET /resource') that only accepts the
+# latest token issued, counts the token requests so callers can check how many refreshes were made
+class TokenStandIn(StandIn):
+    issued = 0
+    current = None
+    delay = 0.2
+    lock = threading.Lock()
+
+    @staticmethod
+    def make_token(expiry, serial=0):
+        def part(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("utf-8").rstrip("=")
+        return f"{part({'alg': 'none'})}.{part({'exp': int(expiry), 'jti': serial})}.signature"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # slow enough that concurrent refreshes would overlap
+        time.sleep(self.delay)
+        with self.lock:
+            TokenStandIn.issued += 1
+            TokenStandIn.current = self.make_token(time.time() + 3600, self.issued)
+            token = self.current
+        self.send_json(200, {"access_token": token, "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        if self.headers.get("Authorization") != self.current:
+            self.send_json(401, {"error": "InvalidAuthenticationToken"})
+        else:
+            self.send_json(200, {"value": []})
+
+
+# stands in for srelib's PIHelper, which reads its own Jira settings, so replayed '--PI' searches reach the
+# Jira stand-in at 'url' instead of the real Jira; only what brian_PI calls is implemented and the jql is ignored
+class PIHelperStandIn:
+    url = None
+
+    class Field:
+        def __init__(self, data):
+            self.data = data
+
+        def get_name(self):
+            return self.data['name']
+
+        def get_display_name(self):
+            return self.data['displayName']
+
+    class Issue:
+        def __init__(self, data):
+            self.data = data
+
+        def __str__(self):
+            return f"key = {self.data['key']}"
+
+        def get_summary(self):
+            return self.data['fields']['summary']
+
+        def get_create_date(self):
+            return self.data['fields']['created']
+
+        def get_priority(self):
+            return PIHelperStandIn.Field(self.data['fields']['priority'])
+
+        def get_assignee(self):
+            assignee = self.data['fields']['assignee']
+            return PIHelperStandIn.Field(assignee) if assignee else None
+
+    class Results:
+        def __init__(self, issues):
+            self.issues = issues
+
+        def get_issues(self):
+            return self.issues
+
+    def submit_search(self, jql_request):
+        r = requests.get(self.url + "/rest/api/2/search", timeout=30)
+        r.raise_for_status()
+        return self.Results([self.Issue(i) for i in r.json()['issues']])
+
+
+# starts a stand-in on a free local port, returns the server and its base url
+def start(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
@@ -1,29 +1,58 @@
+import fcntl
 import json
-import requests
+import os
+import threading
 from props import props
-from make_graph import graphdata
+from make_graph import graphdata, graph_panels, fetch_data
+from message_lease import LeaseStore
+from token_provider import TokenProvider
+
+
+token_provider = TokenProvider.from_props(props)
+leases = None
+leases_lock = threading.Lock()
+
+
+# opens the shared lease store on first use, not at import: render workers import this module too
+def get_leases():
+    global leases
+    if leases is None:
+        with leases_lock:
+            if leases is None:
+                leases = LeaseStore(props['lease_filepath'], ttl=int(props.get('lease_ttl', 300)),
+                                    max_attempts=int(props.get('lease_max_attempts', 3)))
+    return leases
 
 
 """
 Desc: continuously checks messages from teams channel 
-Returns: any new message that it receives
+Returns: any new message that this instance claimed a lease on
 """
 
 
-def check_new_messages():
-    headers = {"Authorization": props['token']}
-    teamschannel = f"{props['base_url']}/teams/{props['teams_id']}/channels/{props['channel_id']}/messages?$top=5"
-    r = requests.get(teamschannel, headers=headers)
+def check_new_messages(skip=()):
+    teamschannel = f"{props['base_url']}/teams/{props['teams_id']}/channels/{props['channel_id']}/messages?$top={props.get('message_top', 5)}"
+    r = token_provider.request("GET", teamschannel)
     data = r.json()
+    processed_messages = load_processed()
     messages = []
     for i in range(len(data['value'])):
         message_id = data['value'][i]['id']
-        if not is_message_processed(message_id):
-            new_message = process(data['value'][i])
-            messages.append(new_message)
+        # already processed, or claimed and still waiting in this instance's scheduler
+        if message_id in processed_messages or message_id in skip:
+            continue
+        # another instance may already be working on it
+        if not get_leases().claim(message_id):
+            continue
+        new_message = process(data['value'][i])
+        messages.append(new_message)
     return messages
 
 
+def load_processed():
+    with open(props['processed_filepath']) as d:
+        return json.load(d)
+
 
 """
 Desc: Used to check whether a given message is in the processed dictionary
@@ -33,8 +62,7 @@ Returns: Boolean
 
 
 def is_message_processed(message_id):
-    with open(props['processed_filepath']) as d:
-        processed_messages = json.load(d)
+    processed_messages = load_processed()
     if message_id in processed_messages:
         return True
     return False
@@ -43,51 +71,73 @@ def is_message_processed(message_id):
 """
 Desc: If a message is not processed, this function processes it
 Params: list of message ID, sender, content
-Returns: list of message content, sender
+Returns: list of message content, sender display name, message ID, sender user ID
 """
 
 
 def process(message_info):
-    with open(props['processed_filepath']) as d:
-        processed_messages = json.load(d)
     message_id = message_info['id']
     message = message_info['body']['content']
     name = message_info['from']['user']['displayName']
-    processed_messages[message_id] = [message, name]
-    out_file = open(props['processed_filepath'], 'w')
-    json.dump(processed_messages, out_file)
-    info = [message, name, message_id]
+    # display names aren't unique, permissions are checked against the user id
+    user_id = message_info['from']['user'].get('id', "")
+    info = [message, name, message_id, user_id]
     return info
 
 
-# checks if there is an error message
+"""
+Desc: Records a message as answered, once its reply has been posted
+Params: list of message content, sender, ID, sender user ID
+"""
+
+
+def mark_processed(info):
+    message, name, message_id = info[:3]
+    path = props['processed_filepath']
+    # several instances share the file: writers take turns on a separate lock file, and the new contents are
+    # swapped in with os.replace so readers (load_processed, without a lock) always see a whole file
+    with open(path + ".lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        processed_messages = load_processed()
+        processed_messages[message_id] = [message, name]
+        with open(path + ".tmp", 'w') as d:
+            json.dump(processed_messages, d)
+        os.replace(path + ".tmp", path)
+    get_leases().complete(message_id)
+
+
+# checks if there is an error message (no series for the query), without rendering
 def check_data(data_url):
-    if graphdata(data_url) == 1:
+    if len(fetch_data(data_url)) == 0:
         return 1
     return 0
 
 
-# replies to the command with an image
-def post_image(channel_url, data_url):
-    graph_bytes = graphdata(data_url)
+# renders the image reply of a graph command (code 2) or a '--compare' command (code 3)
+# payload holds the query url or fetched data, and the series selection options
+def render_reply(code, payload):
+    if code == 2:
+        return graphdata(payload['url'], payload['top'], payload['rank'])
+    return graph_panels(payload['data'], payload['layout'], payload['top'], payload['rank'])
+
+
+def post_encoded_image(channel_url, image):
+    height = int(400 * image.height / image.width)
     json_payload = {
         "body": {
             "contentType": "html",
-            "content": f"<div><img src=\"../hostedContents/1/$value\" width=\"400px\" height=\"300px\"></div>"
+            "content": f"<div><img src=\"../hostedContents/1/$value\" width=\"400px\" height=\"{height}px\"></div>"
         },
         "hostedContents": [
             {
                 '@microsoft.graph.temporaryId': '1',
-                "contentBytes": graph_bytes,
-                "contentType": "image/jpeg"
+                "contentBytes": image.get_base64(),
+                "contentType": image.content_type
             }
         ]
     }
-    headers = {
-                "Content-type": "application/json",
-                "Authorization": props['token']
-                }
-    return requests.post(channel_url, json=json_payload, headers=headers)
+    headers = {"Content-type": "application/json"}
+    return token_provider.request("POST", channel_url, json=json_payload, headers=headers)
 
 
 # replies to the command with an error message
@@ -98,9 +148,6 @@ def post_message(message, channel_url):
             "content": f"<div>{message}</div>"
         },
     }
-    headers = {
-                "Content-type": "application/json",
-                "Authorization": props['token']
-               }
-    return requests.post(channel_url, json=json_payload, headers=headers)
+    headers = {"Content-type": "application/json"}
+    return token_provider.request("POST", channel_url, json=json_payload, headers=headers)
 
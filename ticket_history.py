@@ -0,0 +1,169 @@
+import datetime
+import os
+import threading
+import numpy as np
+
+
+# every observed ticket state change is one row, stored column by column
+# numeric columns are raw int64 files, text columns are int32 codes into an append-only dictionary file
+NUMERIC = ["ts", "created"]
+TEXT = ["ticket", "event", "field", "old", "new", "priority", "assignee"]
+
+
+# converts a jira timestamp ('2021-07-28T15:04:05.000+0000') into unix seconds
+def jira_time(timestring):
+    if not timestring:
+        return 0
+    return int(datetime.datetime.strptime(timestring, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp())
+
+
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.codes = None
+        os.makedirs(path, exist_ok=True)
+
+    def column_file(self, name):
+        if name in NUMERIC:
+            return os.path.join(self.path, name + ".i8")
+        return os.path.join(self.path, name + ".i4")
+
+    def dict_file(self, name):
+        return os.path.join(self.path, name + ".dict")
+
+    def read_dict(self, name):
+        if not os.path.exists(self.dict_file(name)):
+            return []
+        with open(self.dict_file(name)) as f:
+            return f.read().split("\n")[:-1]
+
+    # code for a text value, new values are added to the column's dictionary
+    def encode(self, name, value, added):
+        value = str(value if value is not None else "").replace("\n", " ")
+        codes = self.codes[name]
+        if value not in codes:
+            codes[value] = len(codes)
+            added[name] += [value]
+        return codes[value]
+
+    # appends a batch of events, each a dict with the keys in NUMERIC and TEXT (missing ones are empty)
+    def append(self, events):
+        if len(events) == 0:
+            return
+        with self.lock:
+            if self.codes is None:
+                self.codes = {name: {v: n for n, v in enumerate(self.read_dict(name))} for name in TEXT}
+            added = {name: [] for name in TEXT}
+            columns = {name: np.array([e.get(name, 0) for e in events], dtype=np.int64) for name in NUMERIC}
+            for name in TEXT:
+                columns[name] = np.array([self.encode(name, e.get(name), added) for e in events], dtype=np.int32)
+            # dictionaries first, so a code on disk always has its value
+            for name in TEXT:
+                if added[name]:
+                    with open(self.dict_file(name), "a") as f:
+                        f.write("".join(i + "\n" for i in added[name]))
+            for name in NUMERIC + TEXT:
+                with open(self.column_file(name), "ab") as f:
+                    f.write(columns[name].tobytes())
+
+    # reads every column into arrays, plus the dictionaries that decode the text columns
+    def load(self):
+        columns = {}
+        for name in NUMERIC + TEXT:
+            dtype = np.int64 if name in NUMERIC else np.int32
+            if os.path.exists(self.column_file(name)):
+                columns[name] = np.fromfile(self.column_file(name), dtype=dtype)
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+        # a write cut short leaves some columns longer than others, ignore the partial row
+        rows = min(len(i) for i in columns.values())
+        columns = {name: values[:rows] for name, values in columns.items()}
+        dictionaries = {name: np.array(self.read_dict(name), dtype=object) for name in TEXT}
+        return columns, dictionaries
+
+
+# events as pi_channel records them
+def opened_event(ticket_id, priority, assignee, created):
+    return {"ts": int(datetime.datetime.now().timestamp()), "ticket": ticket_id, "event": "opened",
+            "new": priority, "priority": priority, "assignee": assignee, "created": created}
+
+
+def changed_event(ticket_id, field, old, new, priority, assignee):
+    return {"ts": int(datetime.datetime.now().timestamp()), "ticket": ticket_id, "event": "changed",
+            "field": field, "old": old, "new": new, "priority": priority, "assignee": assignee}
+
+
+def resolved_event(ticket_id):
+    return {"ts": int(datetime.datetime.now().timestamp()), "ticket": ticket_id, "event": "resolved"}
+
+
+# the latest of the given rows for every ticket, as (ticket codes, row indices)
+# picked explicitly with np.unique, since numpy leaves the order of repeated indices in an assignment unspecified
+# rows with the same ticket and time keep their stored order, so the one written last counts
+def last_per_ticket(columns, rows):
+    ordered = rows[np.lexsort((columns['ts'][rows], columns['ticket'][rows]))][::-1]
+    tickets, first = np.unique(columns['ticket'][ordered], return_index=True)
+    return tickets, ordered[first]
+
+
+# index of the latest row for every ticket code, as a dense array (-1 for codes with no rows)
+def latest_rows(columns, size):
+    latest = np.full(size, -1)
+    tickets, rows = last_per_ticket(columns, np.arange(len(columns['ticket'])))
+    latest[tickets] = rows
+    return latest
+
+
+# tickets opened per week, oldest week first
+def weekly_opened(columns, dictionaries, since=0):
+    opened = columns['event'] == code(dictionaries, 'event', "opened")
+    created = np.where(columns['created'] > 0, columns['created'], columns['ts'])[opened]
+    created = created[created >= since]
+    # weeks start on monday (unix time 0 was a thursday)
+    weeks, counts = np.unique((created - 345600) // 604800, return_counts=True)
+    return [[datetime.date.fromtimestamp(int(w) * 604800 + 345600), int(c)] for w, c in zip(weeks, counts)]
+
+
+# count, mean and median hours from creation to resolution by priority
+def resolve_times(columns, dictionaries, since=0):
+    size = len(dictionaries['ticket'])
+    opened = np.flatnonzero(columns['event'] == code(dictionaries, 'event', "opened"))
+    resolved = np.flatnonzero(columns['event'] == code(dictionaries, 'event', "resolved"))
+    # creation time and last known priority for every ticket code
+    created = np.zeros(size, dtype=np.int64)
+    tickets, rows = last_per_ticket(columns, opened)
+    created[tickets] = columns['created'][rows]
+    known = np.flatnonzero(columns['event'] != code(dictionaries, 'event', "resolved"))
+    priority = np.full(size, -1)
+    tickets, rows = last_per_ticket(columns, known)
+    priority[tickets] = columns['priority'][rows]
+    tickets = columns['ticket'][resolved]
+    keep = (created[tickets] > 0) & (created[tickets] >= since)
+    hours = (columns['ts'][resolved][keep] - created[tickets][keep]) / 3600
+    groups = priority[tickets][keep]
+    result = []
+    for group in np.unique(groups):
+        values = hours[groups == group]
+        name = dictionaries['priority'][group] if group >= 0 else "Unknown"
+        result += [[name, len(values), float(np.mean(values)), float(np.median(values))]]
+    return sorted(result, key=lambda i: -i[1])
+
+
+# open tickets per assignee, from each ticket's latest event
+def assignee_load(columns, dictionaries):
+    size = len(dictionaries['ticket'])
+    known = columns['event'] != code(dictionaries, 'event', "resolved")
+    latest = latest_rows(columns, size)
+    latest = latest[latest >= 0]
+    still_open = known[latest]
+    assignees = columns['assignee'][latest[still_open]]
+    counts = np.bincount(assignees, minlength=len(dictionaries['assignee']))
+    result = [[dictionaries['assignee'][n] or "Unassigned", int(c)] for n, c in enumerate(counts) if c > 0]
+    return sorted(result, key=lambda i: -i[1])
+
+
+# dictionary code of a value, -1 if it was never stored
+def code(dictionaries, name, value):
+    matches = np.flatnonzero(dictionaries[name] == value)
+    return int(matches[0]) if len(matches) else -1
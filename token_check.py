@@ -0,0 +1,60 @@
+import argparse
+import sys
+import threading
+import time
+import stand_ins
+from token_provider import TokenProvider
+
+
+"""
+Desc: checks TokenProvider against a local token endpoint stand-in: callers that find the token stale at the
+      same time share one refresh, and a request answered with 401 is retried once with a new token
+Usage: python token_check.py [--callers 20]
+"""
+
+
+def provider(url, token):
+    return TokenProvider(token, endpoint=url + "/token", client_id="check", client_secret="check", margin=300)
+
+
+# many threads ask for an expired token at once, only one of them should reach the endpoint
+def check_shared_refresh(url, callers):
+    stand_ins.TokenStandIn.issued = 0
+    tokens = provider(url, stand_ins.TokenStandIn.make_token(time.time() - 60))
+    start = threading.Barrier(callers)
+    seen = []
+
+    def caller():
+        start.wait()
+        seen.append(tokens.get_token())
+
+    threads = [threading.Thread(target=caller) for i in range(callers)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    issued = stand_ins.TokenStandIn.issued
+    ok = issued == 1 and len(set(seen)) == 1 and seen[0] == stand_ins.TokenStandIn.current
+    print(f"Shared refresh: {callers} stale callers, {issued} token requests, {len(set(seen))} distinct tokens "
+          f"-> {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+# a token that looks valid but was revoked gets a 401, the request is retried once with a fresh token
+def check_retry(url):
+    stand_ins.TokenStandIn.issued = 0
+    tokens = provider(url, stand_ins.TokenStandIn.make_token(time.time() + 3600, -1))
+    r = tokens.request("GET", url + "/resource", timeout=30)
+    issued = stand_ins.TokenStandIn.issued
+    ok = r.status_code == 200 and issued == 1
+    print(f"401 retry: final status {r.status_code}, {issued} token requests -> {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check token refresh against a local token endpoint stand-in.")
+    parser.add_argument("--callers", type=int, default=20, help="Threads asking for the stale token at once.")
+    args = parser.parse_args()
+    server, url = stand_ins.start(stand_ins.TokenStandIn)
+    results = [check_shared_refresh(url, args.callers), check_retry(url)]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,124 @@
+import base64
+import json
+import threading
+import time
+import requests
+
+
+# decodes the 'exp' claim of a JWT, returns None if the token can't be read
+def get_expiry(token):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return int(claims['exp'])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+
+class TokenProvider:
+    def __init__(self, token, endpoint=None, client_id=None, client_secret=None, scope=None, margin=300):
+        self.token = token
+        self.expiry = get_expiry(token)
+        self.endpoint = endpoint
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.refresher = None
+
+    # builds a provider from a properties dictionary (teamsbot.properties or pichannel.properties)
+    @classmethod
+    def from_props(cls, props):
+        return cls(props.get('token'),
+                   endpoint=props.get('token_endpoint') or None,
+                   client_id=props.get('client_id') or None,
+                   client_secret=props.get('client_secret') or None,
+                   scope=props.get('token_scope') or None,
+                   margin=int(props.get('token_refresh_margin', 300)))
+
+    def can_refresh(self):
+        return bool(self.endpoint and self.client_id and self.client_secret)
+
+    # true when the cached token is missing or inside the refresh margin
+    def is_stale(self):
+        if not self.token:
+            return True
+        if self.expiry is None:
+            return False
+        return time.time() >= self.expiry - self.margin
+
+    # returns the cached token, refreshing first if it's about to expire
+    def get_token(self):
+        self.start()
+        token = self.token
+        if self.is_stale() and self.can_refresh():
+            token = self.refresh(token)
+        return token
+
+    # gets a new token from the client-credentials endpoint
+    # callers pass the token they saw; if another thread already replaced it, no second request is made
+    def refresh(self, seen=None):
+        with self.lock:
+            if seen is not None and self.token != seen:
+                return self.token
+            if not self.can_refresh():
+                return self.token
+            data = {"grant_type": "client_credentials",
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret}
+            if self.scope:
+                data['scope'] = self.scope
+            try:
+                r = requests.post(self.endpoint, data=data, timeout=30)
+                r.raise_for_status()
+                info = r.json()
+            except (requests.RequestException, ValueError) as e:
+                print(f"Token refresh failed: {e}")
+                return self.token
+            self.token = info['access_token']
+            self.expiry = get_expiry(self.token)
+            if self.expiry is None and 'expires_in' in info:
+                self.expiry = int(time.time()) + int(info['expires_in'])
+            print("Token refreshed.")
+        self.wake.set()
+        return self.token
+
+    # starts the background thread that refreshes the token ahead of its expiry
+    def start(self):
+        if self.refresher is not None or not self.can_refresh():
+            return
+        with self.lock:
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self.refresh_loop, daemon=True)
+                self.refresher.start()
+
+    def refresh_loop(self):
+        while True:
+            if self.expiry is None:
+                wait = 60
+            else:
+                wait = self.expiry - self.margin - time.time()
+            if wait > 0:
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+            token = self.token
+            if self.refresh(token) == token:
+                # refresh failed, try again shortly instead of spinning
+                self.wake.wait(30)
+                self.wake.clear()
+
+    # sends a request with the current token, retrying once with a new token on a 401
+    def request(self, method, url, headers=None, **kwargs):
+        headers = dict(headers or {})
+        token = self.get_token()
+        headers['Authorization'] = token
+        r = requests.request(method, url, headers=headers, **kwargs)
+        if r.status_code == 401 and self.can_refresh():
+            print("Graph returned 401, refreshing token and retrying.")
+            headers['Authorization'] = self.refresh(token)
+            r = requests.request(method, url, headers=headers, **kwargs)
+        return r
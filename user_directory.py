@@ -0,0 +1,130 @@
+import bisect
+import difflib
+import threading
+import time
+import requests
+from assignee import get_session
+from props import props
+
+
+# lowercases and collapses spaces, so 'Casieri,Alex' and 'casieri,  alex' look the same
+def normalize(name):
+    return " ".join(name.replace(",", ", ").lower().split())
+
+
+# every way a user may be typed: username, display name, 'first last' for 'Last, First', email and its local part
+def keys_for(username, display_name, email):
+    keys = [username, display_name]
+    if "," in display_name:
+        last, first = display_name.split(",", 1)
+        keys += [f"{first} {last}", f"{last} {first}"]
+    if email:
+        keys += [email, email.split("@")[0]]
+    return set(normalize(i) for i in keys if i)
+
+
+# local index of Jira users, so names resolve to usernames before any Jira call
+# lookups go exact match, then prefix (bisect over the sorted keys), then fuzzy suggestions (difflib)
+class UserDirectory:
+    def __init__(self, fetch, refresh_seconds=3600, retry_seconds=60):
+        self.fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.users = {}
+        self.keys = []
+        self.owners = {}
+        self.loaded = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def build(self, users):
+        owners = {}
+        for username, display_name, email in users:
+            for key in keys_for(username, display_name, email):
+                owners.setdefault(key, set()).add(username)
+        with self.lock:
+            self.users = {i[0]: i for i in users}
+            self.owners = owners
+            self.keys = sorted(owners)
+            self.loaded = time.time()
+
+    def refresh(self):
+        try:
+            users = self.fetch()
+            self.build(users)
+            print(f"User directory refreshed: {len(users)} users.")
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # keep answering from the old index (or passing names through, if none loaded yet) and try again
+            # after retry_seconds rather than a whole refresh_seconds
+            print(f"User directory refresh failed: {e}")
+            self.loaded = time.time() - self.refresh_seconds + self.retry_seconds
+        finally:
+            self.refreshing = False
+
+    # loads the index on first use, afterwards refreshes it in the background once it's older than refresh_seconds
+    def ensure_fresh(self):
+        if self.loaded == 0:
+            with self.lock:
+                first = self.loaded == 0 and not self.refreshing
+                self.refreshing = self.refreshing or first
+            if first:
+                self.refresh()
+        elif time.time() - self.loaded > self.refresh_seconds and not self.refreshing:
+            self.refreshing = True
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    def display_name(self, username):
+        user = self.users.get(username)
+        return user[1] if user else username
+
+    def suggestions(self, usernames):
+        return [f"{self.display_name(i)} ({i})" for i in sorted(usernames, key=self.display_name)][:5]
+
+    # returns ["ok", username], ["ambiguous", suggestions] or ["unknown", suggestions]
+    # with 'exact' (e.g. for assigning) a prefix match isn't enough, it returns ["inexact", suggestions]
+    # with an empty index (Jira unreachable since startup) the name is passed through unchanged
+    def resolve(self, name, exact=False):
+        self.ensure_fresh()
+        with self.lock:
+            keys, owners = self.keys, self.owners
+        if len(keys) == 0:
+            return ["ok", name]
+        query = normalize(name)
+        if query in owners:
+            matches = owners[query]
+        else:
+            matches = set()
+            i = bisect.bisect_left(keys, query)
+            while i < len(keys) and keys[i].startswith(query):
+                matches |= owners[keys[i]]
+                i += 1
+            if exact and matches:
+                return ["inexact", self.suggestions(matches)]
+        if len(matches) == 1:
+            return ["ok", next(iter(matches))]
+        if len(matches) > 1:
+            return ["ambiguous", self.suggestions(matches)]
+        # keys much longer or shorter than the query can't reach the cutoff, so they're skipped before difflib
+        candidates = [i for i in keys if abs(len(i) - len(query)) <= len(query) // 3 + 1]
+        close = difflib.get_close_matches(query, candidates, n=5, cutoff=0.75)
+        return ["unknown", self.suggestions(set().union(*(owners[i] for i in close)))]
+
+
+# reads every active Jira user a page at a time, as [username, display name, email]
+def fetch_users():
+    url = props.get('jira_user_search', props['jira_api_base'].rsplit("/", 1)[0] + "/user/search")
+    users = []
+    start = 0
+    while True:
+        r = get_session().get(url, params={"username": ".", "startAt": start, "maxResults": 1000}, timeout=30)
+        r.raise_for_status()
+        page = r.json()
+        users += [[i['name'], i.get('displayName', i['name']), i.get('emailAddress', "")] for i in page
+                  if i.get('active', True)]
+        if len(page) < 1000:
+            return users
+        start += len(page)
+
+
+directory = UserDirectory(fetch_users, int(props.get('user_refresh_seconds', 3600)),
+                          int(props.get('user_retry_seconds', 60)))
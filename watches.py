@@ -0,0 +1,252 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+from make_graph import fetch_all
+from message_parser import presets, validate_tags, check_valid_metric
+from query_planner import planned_url
+from teams_message import post_message, get_leases
+
+
+# spellings of each comparison, Teams sends '<' and '>' html escaped
+OPS = {">": ">", "&gt;": ">", "gt": ">", "above": ">",
+       ">=": ">=", "&gt;=": ">=", "ge": ">=",
+       "<": "<", "&lt;": "<", "lt": "<", "below": "<",
+       "<=": "<=", "&lt;=": "<=", "le": "<="}
+
+WATCH_HELP = ("Usage: --watch METRIC (&gt; | &gt;= | &lt; | &lt;=) VALUE [-t key=value ...] [-nr]<br>"
+              "--watch list<br>--watch remove ID<br>"
+              "The bot checks the metric's latest value every interval and replies in this thread when it crosses "
+              "the threshold, and again when it recovers.")
+
+
+# watches persist in SQLite so they survive restarts and are shared by every bot instance
+class WatchStore:
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS watches ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "metric TEXT NOT NULL, "
+                         "tags TEXT NOT NULL, "
+                         "rate INTEGER NOT NULL, "
+                         "op TEXT NOT NULL, "
+                         "value REAL NOT NULL, "
+                         "channel_url TEXT NOT NULL, "
+                         "owner TEXT NOT NULL, "
+                         "firing INTEGER NOT NULL DEFAULT 0, "
+                         "owner_id TEXT NOT NULL DEFAULT '')")
+            # stores created before owner_id was added get the column, their watches keep an empty owner_id
+            if "owner_id" not in [i[1] for i in conn.execute("PRAGMA table_info(watches)")]:
+                conn.execute("ALTER TABLE watches ADD COLUMN owner_id TEXT NOT NULL DEFAULT ''")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def add(self, metric, tags, rate, op, value, channel_url, owner, owner_id):
+        conn = self.connect()
+        try:
+            cur = conn.execute("INSERT INTO watches (metric, tags, rate, op, value, channel_url, owner, owner_id) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (metric, json.dumps(tags, sort_keys=True), int(rate), op, value, channel_url, owner,
+                                owner_id))
+            return cur.lastrowid
+        finally:
+            conn.close()
+
+    def remove(self, watch_id):
+        conn = self.connect()
+        try:
+            return conn.execute("DELETE FROM watches WHERE id = ?", (watch_id,)).rowcount == 1
+        finally:
+            conn.close()
+
+    # every watch as [id, metric, tags json, rate, op, value, channel url, owner, firing, owner id]
+    def all(self):
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT id, metric, tags, rate, op, value, channel_url, owner, firing, owner_id "
+                                "FROM watches ORDER BY id").fetchall()
+        finally:
+            conn.close()
+
+    # flips a watch between ok and firing, returns False if another instance already did
+    # so each transition is posted once however many instances evaluate the watch
+    def set_firing(self, watch_id, firing):
+        conn = self.connect()
+        try:
+            cur = conn.execute("UPDATE watches SET firing = ? WHERE id = ? AND firing = ?",
+                               (int(firing), watch_id, int(not firing)))
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+
+def describe(metric, tags, op, value):
+    tag_string = " " + ",".join(f"{k}={v}" for k, v in sorted(tags.items())) if tags else ""
+    return f"{metric}{tag_string} {op.replace('<', '&lt;').replace('>', '&gt;')} {value:g}"
+
+
+# parses '--watch ...', returns the reply
+# sender is the display name shown in listings, user_id is what removal rights are checked against
+def command(words, sender, user_id, channel_url, admins, store):
+    if len(words) < 2 or words[1] in ["-h", "--help"]:
+        return WATCH_HELP
+    if words[1] == "list":
+        rows = store.all()
+        if len(rows) == 0:
+            return "No watches set."
+        lines = [f"#{i[0]}: {describe(i[1], json.loads(i[2]), i[4], i[5])} "
+                 f"({'firing' if i[8] else 'ok'}, set by {i[7]})" for i in rows[:50]]
+        if len(rows) > 50:
+            lines += [f"... and {len(rows) - 50} more."]
+        return "<br>".join(lines)
+    if words[1] == "remove":
+        if len(words) != 3 or not words[2].isnumeric():
+            return "Usage: --watch remove ID"
+        rows = {i[0]: i for i in store.all()}
+        watch_id = int(words[2])
+        if watch_id not in rows:
+            return f"No watch #{watch_id}."
+        owner, owner_id = rows[watch_id][7], rows[watch_id][9]
+        # watches stored before owner ids were recorded fall back to the display name
+        owned = owner_id == user_id if owner_id else owner == sender
+        if not owned and user_id not in admins:
+            return f"Watch #{watch_id} was set by {owner}, only they or a bot admin can remove it."
+        store.remove(watch_id)
+        return f"Watch #{watch_id} removed."
+    if len(words) < 4 or words[2] not in OPS:
+        return WATCH_HELP
+    metric = presets[words[1]][0]['full_name'] if words[1] in presets else words[1]
+    op = OPS[words[2]]
+    try:
+        value = float(words[3])
+    except ValueError:
+        return f"'{words[3]}' is not a number."
+    tags = {}
+    rate = True
+    rest = words[4:]
+    for n, word in enumerate(rest):
+        if word in ["-t", "--tags"]:
+            if n + 1 >= len(rest) or not validate_tags(rest[n + 1], tags):
+                return "Invalid tag format. Format for tags: key=value. "
+        elif word in ["-nr", "--norate"]:
+            rate = False
+        elif n == 0 or rest[n - 1] not in ["-t", "--tags"]:
+            return f"Unrecognized argument '{word}'. Type '--watch -h' for options."
+    if not check_valid_metric(metric):
+        return "Metric invalid. Please type a valid metric. "
+    watch_id = store.add(metric, tags, rate, op, value, channel_url, sender, user_id)
+    return f"Watch #{watch_id} set: {describe(metric, tags, op, value)}. I'll reply here when it fires."
+
+
+# which watches breach their threshold, and which are back past it by the hysteresis margin
+# values is the latest value of every series of one query, thresholds/ops are the watches on that query
+# returns two boolean arrays over the watches: (breached, recovered)
+def evaluate(values, thresholds, ops, hysteresis):
+    v = values[np.newaxis, :]
+    t = thresholds[:, np.newaxis]
+    margin = np.abs(t) * hysteresis
+    above = (ops == ">")[:, np.newaxis] | (ops == ">=")[:, np.newaxis]
+    strict = (ops == ">")[:, np.newaxis] | (ops == "<")[:, np.newaxis]
+    over = np.where(strict, v > t, v >= t)
+    under = np.where(strict, v < t, v <= t)
+    breached = np.where(above, over, under).any(axis=1)
+    # a firing watch recovers only once every series is clear of the threshold by the margin
+    recovered = np.where(above, v < t - margin, v > t + margin).all(axis=1)
+    return breached, recovered
+
+
+# latest finite value of every series in a tsdb response, with the series labels
+def latest_values(data):
+    values, labels = [], []
+    for d in data:
+        if type(d['dps']) is tuple:
+            ys = d['dps'][1]
+        else:
+            ys = np.fromiter(d['dps'].values(), dtype=np.float64, count=len(d['dps']))
+        ys = ys[np.isfinite(ys)]
+        if len(ys):
+            values += [ys[-1]]
+            labels += [",".join(f"{k}={v}" for k, v in sorted(d['tags'].items()))]
+    return np.array(values, dtype=np.float64), labels
+
+
+# checks every watch once per interval, on one instance
+# watches are grouped by query (metric, tags, rate) so each distinct query is fetched once, however many
+# thresholds are set on it, and all the queries of a round are fetched at the same time
+class WatchScheduler:
+    def __init__(self, store, interval=60, window="10m-ago", hysteresis=0.05):
+        self.store = store
+        self.interval = interval
+        self.window = window
+        self.hysteresis = hysteresis
+
+    def start(self):
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    # every instance runs this loop, but each round is checked by the one that claims its lease first
+    def loop(self):
+        while True:
+            round_number = int(time.time() // self.interval)
+            key = f"watch-{round_number}"
+            try:
+                if get_leases().claim(key):
+                    try:
+                        self.check()
+                    finally:
+                        get_leases().complete(key)
+            except Exception as e:
+                print(f"Watch check failed: {e}")
+            # rounds start on multiples of the interval, so all instances contend for the same key
+            time.sleep(max(0, (round_number + 1) * self.interval - time.time()))
+
+    def check(self):
+        groups = {}
+        for row in self.store.all():
+            groups.setdefault((row[1], row[2], row[3]), []).append(row)
+        if len(groups) == 0:
+            return
+        endtime = datetime.datetime.strftime(datetime.datetime.now(), "%Y/%m/%d-%H:%M:%S")
+        keys = list(groups)
+        urls = [planned_url(self.window, endtime, metric, json.loads(tags), bool(rate))
+                for metric, tags, rate in keys]
+        t = time.time()
+        datas = fetch_all(urls)
+        print(f"Checked {sum(len(i) for i in groups.values())} watches with {len(urls)} queries "
+              f"in {time.time() - t:.2f} seconds.")
+        for key, data in zip(keys, datas):
+            if type(data) is not list:
+                continue
+            values, labels = latest_values(data)
+            if len(values) == 0:
+                continue
+            rows = groups[key]
+            breached, recovered = evaluate(values, np.array([i[5] for i in rows], dtype=np.float64),
+                                           np.array([i[4] for i in rows]), self.hysteresis)
+            # set_firing claims the transition, and is undone if the alert can't be posted so the next round
+            # sees the same transition and tries again
+            for row, breach, recover in zip(rows, breached, recovered):
+                if not row[8] and breach and self.store.set_firing(row[0], True):
+                    if not self.alert(row, values, labels, "fired"):
+                        self.store.set_firing(row[0], False)
+                elif row[8] and recover and self.store.set_firing(row[0], False):
+                    if not self.alert(row, values, labels, "recovered"):
+                        self.store.set_firing(row[0], True)
+
+    # posts the alert in the watch's thread, returns whether it was posted
+    def alert(self, row, values, labels, event):
+        shown = ", ".join(f"{l + ': ' if l else ''}{v:g}" for l, v in list(zip(labels, values))[:5])
+        message = f"Watch #{row[0]} {event}: {describe(row[1], json.loads(row[2]), row[4], row[5])} (latest {shown})"
+        try:
+            r = post_message(message, row[6])
+        except Exception as e:
+            print(f"Watch #{row[0]} alert failed: {e}")
+            return False
+        if not r.ok:
+            print(f"Watch #{row[0]} alert failed: {r.status_code}")
+        return r.ok